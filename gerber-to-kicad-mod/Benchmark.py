@@ -0,0 +1,262 @@
+'''
+Benchmarks of the import and export pipeline on synthetic layouts, see README.md.
+'''
+
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import tempfile
+import warnings
+import subprocess
+from time import perf_counter, strftime
+from statistics import median
+
+import shapely
+
+import SyntheticLayout
+import ModuleExport
+from LayoutFile import LayoutFile
+from GerberLayer import GerberLayer
+
+# Benchmark cases: file format and synthetic structure parameters
+CASES = {
+    'gbr-small':  {'format': 'gbr', 'regions': 100,  'vertices': 16, 'holes': 0, 'overlap': 0.1},
+    'gbr-medium': {'format': 'gbr', 'regions': 1000, 'vertices': 32, 'holes': 1, 'overlap': 0.2},
+    'gbr-large':  {'format': 'gbr', 'regions': 5000, 'vertices': 64, 'holes': 2, 'overlap': 0.2},
+    'dxf-small':  {'format': 'dxf', 'regions': 100,  'vertices': 16, 'holes': 0, 'overlap': 0.1},
+    'dxf-medium': {'format': 'dxf', 'regions': 1000, 'vertices': 32, 'holes': 1, 'overlap': 0.2},
+}
+
+DEFAULT_CASES = ['gbr-small', 'gbr-medium', 'dxf-small', 'dxf-medium']
+
+# Modules imported by a headless script reading a layout file and exporting a footprint
+HEADLESS_MODULES = ['LayoutFile', 'GerberLayer', 'ModuleExport']
+# Format backends, exporter and GUI packages that must not be loaded by the headless import
+LAZY_MODULES = ['gerber', 'ezdxf', 'KicadModTree', 'matplotlib', 'descartes', 'tkinter', 'concurrent.futures.process']
+
+def _measure(stage, repeat, setup = None):
+    '''
+    Run a stage repeat times and return the timing statistics and the result of the last run.
+    The optional setup function creates the stage argument outside of the timed section.
+    '''
+    times = []
+    result = None
+
+    for _ in range(repeat):
+        arg = setup() if setup != None else None
+
+        t0 = perf_counter()
+        result = stage(arg)
+        times.append(perf_counter() - t0)
+
+    return {'min': min(times), 'median': median(times), 'repeat': repeat}, result
+
+def _readLayout(filename):
+    lf = LayoutFile()
+    lf.read(filename)
+    # the layers are merged on first access
+    lf.get_layers()
+
+    return lf
+
+def _rawLayer(lf):
+    '''
+    Create a layer from the first layout file layer without cleanup.
+    '''
+    layer = GerberLayer()
+    layer._loadLayerPoly(lf.get_layer_poly(lf.get_layer_names()[0]))
+
+    return layer
+
+def _cleanup(layer):
+    layer._cleanupLayer()
+
+    return layer
+
+def _queryPoints(layer, count, seed = 0):
+    rnd = random.Random(seed)
+    (minx, miny, maxx, maxy) = layer.boundingBox()
+
+    return [(rnd.uniform(minx, maxx), rnd.uniform(miny, maxy)) for _ in range(count)]
+
+def _addPads(layer, count):
+    '''
+    Place a pad on the first edge of the first nets.
+    '''
+    for net in layer.getNets()[:count]:
+        x, y = net.getPolygon().exterior.coords[0]
+        edge, _ = net.closestEdge(x, y)
+        layer.addPad(net, net.generateRectPad(edge, shift=1, width=0.1, height=0.1))
+
+def runCase(name, spec, workdir, repeat = 3, queries = 200):
+    '''
+    Generate the case input file and time every stage of the import and export pipeline.
+    '''
+    polys = SyntheticLayout.generateStructure(spec['regions'], spec['vertices'], spec['holes'], spec['overlap'])
+
+    if spec['format'] == 'dxf':
+        filename = os.path.join(workdir, name + '.dxf')
+        SyntheticLayout.writeDxf(filename, polys)
+    else:
+        filename = os.path.join(workdir, name + '.gbr')
+        SyntheticLayout.writeGerber(filename, polys)
+
+    stages = {}
+
+    stages['read'], lf = _measure(lambda _: _readLayout(filename), repeat)
+    stages['cleanup'], layer = _measure(_cleanup, repeat, lambda: _rawLayer(lf))
+
+    pts = _queryPoints(layer, queries)
+    stages['closestNet'], nets = _measure(lambda _: [layer.closestNet(x, y)[0] for x, y in pts], repeat)
+    stages['closestEdge'], _ = _measure(lambda _: [n.closestEdge(x, y) for n, (x, y) in zip(nets, pts)], repeat)
+
+    _addPads(layer, 10)
+    out = os.path.join(workdir, name + '.kicad_mod')
+    stages['export'], _ = _measure(lambda _: ModuleExport.exportKiCadModule([layer], out), repeat)
+
+    return {
+        'spec': spec,
+        'nets': len(layer.getNets()),
+        'vertices': int(shapely.get_num_coordinates(layer.getMultiPolygon())),
+        'stages': stages,
+    }
+
+def _importTime(modules):
+    '''
+    Import the modules in a fresh interpreter.
+    Return the import time and the list of LAZY_MODULES loaded by the import.
+    '''
+    code = ('import sys, json\n'
+            'from time import perf_counter\n'
+            't0 = perf_counter()\n'
+            'import %s\n'
+            't = perf_counter() - t0\n'
+            'print(json.dumps([t, [m for m in %r if m in sys.modules]]))\n') % (', '.join(modules), LAZY_MODULES)
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    return json.loads(out)
+
+def runImport(repeat = 3):
+    '''
+    Time the headless import of the package, every run in a new interpreter.
+    '''
+    times = []
+    loaded = []
+
+    for _ in range(repeat):
+        t, loaded = _importTime(HEADLESS_MODULES)
+        times.append(t)
+
+    return {
+        'modules': HEADLESS_MODULES,
+        'loaded': loaded,
+        'stages': {'import': {'min': min(times), 'median': median(times), 'repeat': repeat}},
+    }
+
+def runSuite(cases, repeat = 3, queries = 200):
+    '''
+    Run the benchmark cases and return the results as JSON serializable dictionary.
+    '''
+    results = {
+        'meta': {
+            'date': strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'shapely': shapely.__version__,
+            'geos': shapely.geos_version_string,
+            'repeat': repeat,
+            'queries': queries,
+        },
+        'cases': {},
+    }
+
+    print('Running startup ...')
+    results['cases']['startup'] = runImport(max(repeat, 5))
+
+    if results['cases']['startup']['loaded']:
+        print('Warning: the headless import loads %s' % (', '.join(results['cases']['startup']['loaded']),))
+
+    with tempfile.TemporaryDirectory() as workdir, warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+
+        for name in cases:
+            print('Running %s ...' % (name,))
+            results['cases'][name] = runCase(name, CASES[name], workdir, repeat, queries)
+
+    return results
+
+def compare(base, new, threshold = 0.1):
+    '''
+    Compare the median stage times of two result sets.
+    Return a list of (case, stage, base_time, new_time, ratio, regression) tuples.
+    '''
+    rows = []
+
+    for case, result in new['cases'].items():
+        if case not in base['cases']:
+            continue
+
+        for stage, stats in result['stages'].items():
+            if stage not in base['cases'][case]['stages']:
+                continue
+
+            t_base = base['cases'][case]['stages'][stage]['median']
+            t_new = stats['median']
+            ratio = t_new / t_base if t_base > 0 else 1.0
+
+            rows.append((case, stage, t_base, t_new, ratio, ratio > 1 + threshold))
+
+    return rows
+
+def printResults(results):
+    print('%-12s %-12s %10s %10s' % ('case', 'stage', 'min (ms)', 'med (ms)'))
+
+    for case, result in results['cases'].items():
+        for stage, stats in result['stages'].items():
+            print('%-12s %-12s %10.2f %10.2f' % (case, stage, stats['min'] * 1e3, stats['median'] * 1e3))
+
+def printComparison(rows):
+    print('%-12s %-12s %10s %10s %7s' % ('case', 'stage', 'base (ms)', 'new (ms)', 'ratio'))
+
+    for case, stage, t_base, t_new, ratio, regression in rows:
+        print('%-12s %-12s %10.2f %10.2f %7.2f%s' % (case, stage, t_base * 1e3, t_new * 1e3, ratio, '  REGRESSION' if regression else ''))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the gerber/dxf import and kicad_mod export pipeline.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    prun = sub.add_parser('run', help='Run the benchmark suite')
+    prun.add_argument('--cases', nargs='+', default=DEFAULT_CASES, choices=sorted(CASES.keys()))
+    prun.add_argument('--repeat', type=int, default=3)
+    prun.add_argument('--queries', type=int, default=200)
+    prun.add_argument('--output', '-o', help='Write the results to a JSON file')
+
+    pcmp = sub.add_parser('compare', help='Compare two result files')
+    pcmp.add_argument('base')
+    pcmp.add_argument('new')
+    pcmp.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown flagged as regression')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = runSuite(args.cases, args.repeat, args.queries)
+        printResults(results)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    elif args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+
+        rows = compare(base, new, args.threshold)
+        printComparison(rows)
+
+        if any(r[5] for r in rows):
+            sys.exit(1)
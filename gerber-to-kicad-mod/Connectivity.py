@@ -0,0 +1,206 @@
+'''
+Connectivity of the nets of several copper layers through vias.
+
+The nets of all layers and the vias are the nodes of a union-find. Every via is joined with the nets it
+overlaps on the layers it connects, the overlaps are found with the net index of each layer. Nets joined
+through one or more vias form a net group, the pads of all nets of a group get the same pad number on export.
+'''
+
+import numpy as np
+import shapely
+
+import Instrumentation as inst
+
+class _UnionFind(object):
+    '''
+    Disjoint sets of the integers 0..n-1 with union by size and path halving.
+    '''
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, a):
+        parent = self.parent
+
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+
+        return a
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+
+        if a == b:
+            return
+
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+class Connectivity(object):
+    '''
+    Net groups of a list of GerberLayers connected through vias.
+    '''
+    def __init__(self, layers, vias, viaLayers = None):
+        '''
+        @param layers: List of GerberLayer objects.
+        @param vias: List or array of via geometries (drill holes), see viasFromDrillFile.
+        @param viaLayers: Optional list with the layer ids every via connects (blind and buried vias), None for
+            vias through all layers.
+        '''
+        self.layers = layers
+        self.vias = np.asarray(vias, dtype=object)
+        self.viaLayers = viaLayers
+        # net group of every net (in layer order) followed by every via, built on first use
+        self._groups = None
+        # net revisions of the layers the groups were built for
+        self._revisions = None
+
+    def _nodeOffsets(self):
+        '''
+        Return the index of the first net of every layer in the node list and the number of nets.
+        '''
+        offsets = np.cumsum([0] + [len(layer.getNets()) for layer in self.layers])
+
+        return (offsets[:-1], offsets[-1])
+
+    def _netRevisions(self):
+        revisions = []
+
+        for layer in self.layers:
+            # the nets are accessed first: lazily created layers are loaded, derived layers updated
+            layer.getNets()
+            revisions.append(layer.netRevision)
+
+        return revisions
+
+    def _build(self):
+        self._revisions = self._netRevisions()
+        offsets, nnets = self._nodeOffsets()
+        uf = _UnionFind(nnets + len(self.vias))
+
+        with inst.span('Connectivity.build'):
+            for layer, offset in zip(self.layers, offsets):
+                if self.viaLayers == None:
+                    sel = np.arange(len(self.vias))
+                else:
+                    sel = np.array([i for i, ids in enumerate(self.viaLayers) if layer.getID() in ids], dtype=int)
+
+                if len(sel) == 0:
+                    continue
+
+                via, net = layer.queryNets(self.vias[sel], predicate='intersects')
+                inst.count('via_overlaps', len(via))
+
+                for a, b in zip((sel[via] + nnets).tolist(), (net + offset).tolist()):
+                    uf.union(a, b)
+
+            # number the groups in node order
+            ids = {}
+            self._groups = np.array([ids.setdefault(uf.find(a), len(ids)) for a in range(nnets + len(self.vias))], dtype=int)
+
+    def _getGroups(self):
+        # rebuilt when the nets of a layer changed, e.g. on reload
+        if (self._groups is None) or (self._revisions != self._netRevisions()):
+            self._build()
+
+        return self._groups
+
+    def netGroups(self, layer):
+        '''
+        Return the net group of every net of a layer as array. Groups are numbered in layer and net order.
+        '''
+        offsets, _ = self._nodeOffsets()
+        offset = offsets[self.layers.index(layer)]
+
+        return self._getGroups()[offset:offset + len(layer.getNets())]
+
+    def connectedNets(self, layer, net):
+        '''
+        Return the nets connected to a net (including the net itself) as list of (layer, net) tuples.
+        '''
+        group = self.netGroups(layer)[layer.getNets().index(net)]
+
+        return [(l, n) for l in self.layers for n, g in zip(l.getNets(), self.netGroups(l)) if g == group]
+
+    def viaGroups(self):
+        '''
+        Return the net group of every via as array. A via without copper on any layer has a group of its own.
+        '''
+        _, nnets = self._nodeOffsets()
+
+        return self._getGroups()[nnets:]
+
+    def padNumbers(self, pads = None, startpad = 1):
+        '''
+        Return the pad numbers of the nets as dictionary {layer: [pad number or None for every net]}.
+        Connected nets share one number, the net groups with pads are numbered in layer and net order.
+        Without vias this is the numbering of appendKicadLayer.
+
+        @param pads: Optional dictionary {layer: {net: [pad polygons]}} replacing the placed pads of the listed
+            layers, like the pads of the export variants.
+        '''
+        if pads == None:
+            pads = {}
+
+        numbers = {}
+        groupNumbers = {}
+
+        for layer in self.layers:
+            layerPads = pads.get(layer)
+            layerNumbers = []
+
+            for net, group in zip(layer.getNets(), self.netGroups(layer).tolist()):
+                netPads = net.getPads() if layerPads == None else layerPads.get(net, [])
+
+                if len(netPads) == 0:
+                    layerNumbers.append(None)
+                    continue
+
+                if group not in groupNumbers:
+                    groupNumbers[group] = startpad + len(groupNumbers)
+
+                layerNumbers.append(groupNumbers[group])
+
+            numbers[layer] = layerNumbers
+
+        return numbers
+
+def viasFromDrillFile(filename, arc_segments = 32):
+    '''
+    Read the plated holes of an Excellon drill file as via polygons (mm). Slots are included, holes of
+    non plated tools are skipped.
+
+    @param arc_segments: Number of segments of a full circle.
+    '''
+    import gerber
+    from gerber.excellon import DrillHit, DrillSlot
+    from gerber.excellon_statements import ExcellonTool
+
+    with inst.span('Connectivity.parse_drill'):
+        drl = gerber.read(filename)
+        drl.to_metric()
+
+    centers = []
+    radii = []
+
+    for hit in drl.hits:
+        if hit.tool.plated == ExcellonTool.PLATED_NO:
+            continue
+
+        if isinstance(hit, DrillHit):
+            centers.append(shapely.Point(hit.position))
+        elif isinstance(hit, DrillSlot):
+            centers.append(shapely.LineString([hit.start, hit.end]))
+        else:
+            continue
+
+        radii.append(hit.tool.diameter / 2)
+
+    inst.count('vias', len(centers))
+
+    return shapely.buffer(np.array(centers, dtype=object), radii, quad_segs=max(1, arc_segments // 4))
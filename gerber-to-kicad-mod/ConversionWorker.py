@@ -0,0 +1,256 @@
+'''
+Long running conversion worker for batch pipelines.
+
+The worker keeps the imported modules, the parsed layout files and the loaded layers in memory and
+converts footprints for a stream of jobs. A job is a FootprintBuild spec (one JSON object per line),
+optionally with an "id" that is copied to the result:
+
+    {"id": 1, "output": "Coupler.kicad_mod", "layers": [{"filename": "coupler.gbr"}], "pads": [...]}
+
+Jobs are read from stdin or from the connections of a local socket and processed concurrently. Every job
+is answered with one JSON line, in the order the jobs finish:
+
+    {"id": 1, "ok": true, "output": "Coupler.kicad_mod", "cache": ["hit"], "timings": {"layers": ..., "pads": ..., "export": ..., "total": ...}}
+    {"id": 2, "ok": false, "error": "..."}
+
+Parsed files are cached per (path, modification time, size, grid size), loaded layers additionally per
+layer id. Both caches evict the least recently used entries. The pads of a job are passed to the export
+and not added to the cached layers, concurrent jobs can share them.
+'''
+
+import io
+import os
+import sys
+import json
+import importlib
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+
+import FootprintBuild
+import Instrumentation as inst
+
+class _LRUCache(object):
+    '''
+    Thread safe LRU cache of values created on demand. Concurrent requests of a missing key wait for one creation.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, create):
+        '''
+        Return tuple (value, hit). create() is called without holding the lock.
+        '''
+        with self._lock:
+            future = self._entries.get(key)
+            hit = future != None
+
+            if hit:
+                self._entries.move_to_end(key)
+            else:
+                future = Future()
+                self._entries[key] = future
+
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+        if not hit:
+            try:
+                future.set_result(create())
+            except BaseException as e:
+                with self._lock:
+                    if self._entries.get(key) is future:
+                        del self._entries[key]
+
+                future.set_exception(e)
+
+        return (future.result(), hit)
+
+    def __len__(self):
+        return len(self._entries)
+
+class ConversionWorker(object):
+    '''
+    Converts build specs with warm caches of parsed files and loaded layers.
+    '''
+    def __init__(self, max_layouts = 16, max_layers = 64, workers = 4):
+        '''
+        @param max_layouts: Number of parsed layout files kept in memory.
+        @param max_layers: Number of loaded layers kept in memory.
+        @param workers: Number of jobs processed concurrently.
+        '''
+        self.layouts = _LRUCache(max_layouts)
+        self.layers = _LRUCache(max_layers)
+        self.executor = ThreadPoolExecutor(workers)
+
+    def warmup(self):
+        '''
+        Import the format backends and the exporter, which are otherwise imported on first use.
+        '''
+        for name in ('gerber', 'ezdxf', 'ezdxf.path', 'KicadModTree', 'LayoutFile', 'GerberLayer', 'ModuleExport'):
+            importlib.import_module(name)
+
+    def _layoutKey(self, filename, grid_size):
+        st = os.stat(filename)
+
+        return (os.path.abspath(filename), st.st_mtime_ns, st.st_size, grid_size)
+
+    def _readLayout(self, filename, grid_size):
+        '''
+        Parse a file, return tuple (layout file, lock). The layers of the layout file are merged on first
+        access, the lock serializes the loading of the layers.
+        '''
+        from LayoutFile import LayoutFile
+
+        lf = LayoutFile(grid_size)
+        lf.read(filename, filename + ':')
+
+        return (lf, threading.Lock())
+
+    def _loadLayer(self, key, id):
+        from GerberLayer import layersFromLayoutFile
+
+        filename, _, _, grid_size = key
+        (lf, lock), _ = self.layouts.get(key, partial(self._readLayout, filename, grid_size))
+
+        # first layer of the file like GerberLayer(id, filename=filename)
+        layer = layersFromLayoutFile(lf, id=id)[0]
+        layer.filename = filename
+
+        with lock:
+            layer.load()
+
+        return layer
+
+    def getLayer(self, filename, id = 'F.Cu', grid_size = None):
+        '''
+        Return tuple (layer, hit) with the cached layer of a file, loaded if the file is not cached or changed.
+        '''
+        key = self._layoutKey(filename, grid_size)
+
+        return self.layers.get((key, id), partial(self._loadLayer, key, id))
+
+    def convert(self, job):
+        '''
+        Convert one job (build spec) and return the result dictionary.
+        '''
+        result = {'id': job.get('id')}
+        t0 = perf_counter()
+
+        try:
+            layers = []
+            cache = []
+
+            for l in job['layers']:
+                layer, hit = self.getLayer(l['filename'], l.get('id', 'F.Cu'), l.get('grid_size'))
+                layers.append(layer)
+                cache.append('hit' if hit else 'miss')
+
+            t1 = perf_counter()
+            pads = FootprintBuild.specPads(layers, job)
+            t2 = perf_counter()
+            FootprintBuild.exportSpec(layers, job, pads)
+            t3 = perf_counter()
+
+            inst.count('worker.jobs')
+            result.update({'ok': True, 'output': job['output'], 'cache': cache,
+                           'timings': {'layers': t1 - t0, 'pads': t2 - t1, 'export': t3 - t2, 'total': t3 - t0}})
+        except Exception as e:
+            inst.count('worker.failed')
+            result.update({'ok': False, 'error': '%s: %s' % (type(e).__name__, str(e)), 'timings': {'total': perf_counter() - t0}})
+
+        return result
+
+    def submit(self, line, respond):
+        '''
+        Parse a JSON line and convert it in the thread pool, respond(result) is called when the job is done.
+        '''
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            respond({'id': None, 'ok': False, 'error': 'Invalid job: %s' % (str(e),)})
+            return None
+
+        if not isinstance(job, dict):
+            respond({'id': None, 'ok': False, 'error': 'Invalid job: not a JSON object'})
+            return None
+
+        return self.executor.submit(lambda: respond(self.convert(job)))
+
+    def serveLines(self, infile, outfile):
+        '''
+        Process the jobs of a line stream and write the results to an output stream.
+        Returns when the input is closed and all jobs are done.
+        '''
+        lock = threading.Lock()
+        futures = []
+
+        def respond(result):
+            with lock:
+                outfile.write(json.dumps(result) + '\n')
+                outfile.flush()
+
+        for line in infile:
+            if line.strip():
+                futures.append(self.submit(line, respond))
+
+        for f in futures:
+            if f != None:
+                f.result()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        infile = io.TextIOWrapper(self.rfile, encoding='utf-8')
+        outfile = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+
+        self.server.worker.serveLines(infile, outfile)
+
+def serveSocket(worker, path = None, port = None):
+    '''
+    Serve jobs on a unix domain socket (path) or on a TCP port of localhost until interrupted.
+    '''
+    if path != None:
+        if os.path.exists(path):
+            os.unlink(path)
+
+        server = socketserver.ThreadingUnixStreamServer(path, _JobHandler)
+    else:
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', port), _JobHandler)
+
+    server.daemon_threads = True
+    server.worker = worker
+
+    with server:
+        server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert footprint build specs (JSON lines) with warm caches.')
+    parser.add_argument('--socket', help='Serve on a unix domain socket instead of stdin/stdout')
+    parser.add_argument('--port', type=int, help='Serve on a TCP port of localhost instead of stdin/stdout')
+    parser.add_argument('--workers', '-j', type=int, default=4, help='Number of concurrent jobs')
+    parser.add_argument('--max-layouts', type=int, default=16, help='Number of parsed files kept in memory')
+    parser.add_argument('--max-layers', type=int, default=64, help='Number of loaded layers kept in memory')
+
+    args = parser.parse_args()
+
+    worker = ConversionWorker(args.max_layouts, args.max_layers, args.workers)
+    worker.warmup()
+
+    try:
+        if (args.socket != None) or (args.port != None):
+            serveSocket(worker, args.socket, args.port)
+        else:
+            worker.serveLines(sys.stdin, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.shutdown()
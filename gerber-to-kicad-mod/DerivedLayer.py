@@ -0,0 +1,219 @@
+'''
+Layers derived from a copper layer by offsetting, e.g. solder mask openings and paste apertures.
+
+The nets of a derived layer are the connected parts of the union of the buffered pads (and optionally
+the buffered copper) of the source layer. They are updated on access when the source changed:
+
+    pad added       the buffered pad is merged with the parts it overlaps
+    pad removed     the parts the pad overlapped are rebuilt from the buffered copper and pads
+    nets replaced   full rebuild
+
+The buffered copper and pads are kept, a pad placed in the GUI does not recompute the whole union.
+'''
+
+import weakref
+
+import numpy as np
+import shapely
+
+from GerberLayer import GerberLayer, _orientPolygons
+from GerberNet import GerberNet
+import Instrumentation as inst
+
+# Derived layers per source layer, keyed by (id, margin, join_style, copper). The derived layers only hold
+# a weak reference to their source, the entry is dropped with the source layer.
+_cache = weakref.WeakKeyDictionary()
+
+# KiCad layer ids of the derived layers of the outer copper layers
+_MASK_IDS = {'F.Cu': 'F.Mask', 'B.Cu': 'B.Mask'}
+_PASTE_IDS = {'F.Cu': 'F.Paste', 'B.Cu': 'B.Paste'}
+
+def derivedLayer(source, id, margin, join_style = 'round', copper = False, color = None):
+    '''
+    Return the derived layer of a source layer, cached per (source layer, id, margin, join_style, copper).
+    See DerivedLayer for the parameters.
+    '''
+    layers = _cache.setdefault(source, {})
+    key = (id, margin, join_style, copper)
+
+    if key not in layers:
+        layers[key] = DerivedLayer(source, id, margin, join_style, copper, color)
+
+    return layers[key]
+
+def _outerId(source, ids):
+    if source.getID() not in ids:
+        raise ValueError('%s is not an outer copper layer (F.Cu, B.Cu).' % (source.getID(),))
+
+    return ids[source.getID()]
+
+def maskLayer(source, margin = 0.05, join_style = 'round', copper = True):
+    '''
+    Solder mask openings of an outer copper layer (F.Cu, B.Cu): pads and copper expanded by the margin.
+    '''
+    return derivedLayer(source, _outerId(source, _MASK_IDS), margin, join_style, copper, '#A020A0')
+
+def pasteLayer(source, margin = -0.05, join_style = 'mitre'):
+    '''
+    Paste apertures of an outer copper layer (F.Cu, B.Cu): pads shrunk by the margin (negative).
+    '''
+    return derivedLayer(source, _outerId(source, _PASTE_IDS), margin, join_style, False, '#A0A0A0')
+
+class DerivedLayer(GerberLayer):
+    '''
+    Layer generated from the pads and copper of a source layer by offsetting.
+    '''
+    def __init__(self, source, id, margin, join_style = 'round', copper = False, color = None):
+        '''
+        @param source: The source GerberLayer.
+        @param id: KiCad layer id of the derived layer, e.g. 'F.Mask'.
+        @param margin: Offset in mm, negative values shrink.
+        @param join_style: Corner style of the offset: 'round', 'mitre' or 'bevel'.
+        @param copper: Include the copper (nets) of the source layer, otherwise only the pads.
+        '''
+        super(DerivedLayer, self).__init__(id, source.arc_segments, source.tolerance, color or source.getColor(),
+                                           grid_size = source.grid_size)
+        self.grid = source.grid
+        # weak, the derived layers are cached per source layer
+        self._sourceLayer = weakref.ref(source)
+        self.margin = margin
+        self.join_style = join_style
+        self.copper = copper
+
+        # revisions of the source the nets are derived from
+        self._netRevision = None
+        self._padRevision = None
+        # buffered copper of the source nets
+        self._copperBuffers = None
+        # buffered pads by id(pad), with the pad to keep the id valid
+        self._padBuffers = {}
+
+    def __getstate__(self):
+        # pickled for other processes without the source layer
+        self._update()
+
+        state = super(DerivedLayer, self).__getstate__()
+        state['_sourceLayer'] = None
+        state['_copperBuffers'] = None
+        state['_padBuffers'] = {}
+
+        return state
+
+    @property
+    def source(self):
+        '''
+        The source layer, None if it was deleted or the layer was pickled.
+        '''
+        if self._sourceLayer == None:
+            return None
+
+        return self._sourceLayer()
+
+    @property
+    def nets(self):
+        self._update()
+
+        return self._nets
+
+    @nets.setter
+    def nets(self, nets):
+        GerberLayer.nets.fset(self, nets)
+
+    def getGeometryArray(self):
+        self._update()
+
+        return super(DerivedLayer, self).getGeometryArray()
+
+    def _buffer(self, geoms):
+        return shapely.buffer(geoms, self.margin, quad_segs=max(1, self.arc_segments // 4), join_style=self.join_style)
+
+    def _sourcePads(self, source):
+        return {id(pad): pad for net in source.getNets() for pad in net.getPads()}
+
+    def _update(self):
+        '''
+        Bring the nets up to date with the source layer.
+        '''
+        source = self.source
+
+        if source == None:
+            return
+
+        if self._netRevision != source.netRevision:
+            self._rebuild(source)
+        elif self._padRevision != source.padRevision:
+            self._updatePads(source)
+
+    def _setParts(self, parts):
+        parts = _orientPolygons(parts[~shapely.is_empty(parts)])
+
+        GerberLayer.nets.fset(self, [GerberNet(poly) for poly in parts])
+        self._geoms = parts
+
+    def _rebuild(self, source):
+        with inst.span('DerivedLayer.rebuild'):
+            self.grid = source.grid
+            pads = self._sourcePads(source)
+            padBuffers = self._buffer(np.array(list(pads.values()), dtype=object))
+            self._padBuffers = {k: (pad, buf) for (k, pad), buf in zip(pads.items(), padBuffers)}
+
+            if self.copper:
+                self._copperBuffers = self._buffer(source.getGeometryArray())
+            else:
+                self._copperBuffers = np.array([], dtype=object)
+
+            sources = np.concatenate((self._copperBuffers, padBuffers))
+            self._setParts(shapely.get_parts(shapely.unary_union(sources, grid_size=self.grid)))
+
+        self._netRevision = source.netRevision
+        self._padRevision = source.padRevision
+
+    def _updatePads(self, source):
+        '''
+        Apply the added and removed pads of the source to the current parts.
+        '''
+        pads = self._sourcePads(source)
+        removed = [k for k in self._padBuffers if k not in pads]
+        added = [k for k in pads if k not in self._padBuffers]
+        parts = self._geoms
+
+        with inst.span('DerivedLayer.update_pads'):
+            hit = np.zeros(len(parts), dtype=bool)
+
+            for k in removed:
+                _, buf = self._padBuffers.pop(k)
+                hit |= shapely.intersects(parts, buf)
+
+            if hit.any():
+                # rebuild the parts touched by the removed pads from the remaining sources
+                padBuffers = np.array([buf for _, buf in self._padBuffers.values()], dtype=object)
+                sources = np.concatenate((self._copperBuffers, padBuffers))
+
+                while True:
+                    rebuilt = shapely.unary_union(sources[shapely.intersects(sources, shapely.unary_union(parts[hit]))], grid_size=self.grid)
+                    # parts touching in a single point are separate parts of the same union
+                    grown = hit | shapely.intersects(parts, rebuilt)
+
+                    if np.array_equal(grown, hit):
+                        break
+
+                    hit = grown
+
+                parts = np.concatenate((parts[~hit], shapely.get_parts(rebuilt)))
+
+            for k in added:
+                # merge the buffered pad with the parts it overlaps
+                buf = self._buffer(pads[k])
+                self._padBuffers[k] = (pads[k], buf)
+
+                if shapely.is_empty(buf):
+                    continue
+
+                hit = shapely.intersects(parts, buf)
+                merged = shapely.unary_union(np.append(parts[hit], buf), grid_size=self.grid)
+                parts = np.concatenate((parts[~hit], shapely.get_parts(merged)))
+
+            inst.count('derived.pad_updates', len(removed) + len(added))
+            self._setParts(parts)
+
+        self._padRevision = source.padRevision
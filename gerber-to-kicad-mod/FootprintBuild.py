@@ -0,0 +1,213 @@
+'''
+Incremental footprint builds.
+
+A footprint is described by a build spec (JSON serializable dictionary):
+
+    {
+        "output": "EM.pretty/Coupler.kicad_mod",
+        "footprint_name": "Coupler", "description": "...", "tags": "...",
+        "layers": [{"filename": "coupler.gbr", "id": "F.Cu", "grid_size": null}],
+        "pads": [{"layer": 0, "x": 1.0, "y": 2.5, "shift": 1, "width": 0.5, "height": 0}]
+    }
+
+A pad is placed on the net edge closest to (x, y) like a click in the GUI, see GerberNet.generateRectPad
+for shift, width and height. padSpecs() creates the pad specs from the pads of loaded layers.
+Relative paths are relative to the directory of the spec file.
+
+The fingerprint of a spec covers the source file hashes, the pads and the export settings. The manifest
+stores the fingerprint and the content hash of every written footprint. A footprint is skipped if its
+fingerprint is unchanged and the output file was not modified, the source files are hashed but not parsed.
+'''
+
+import os
+import json
+import hashlib
+import argparse
+
+from LayoutFile import file_hash
+import Instrumentation as inst
+
+# Increase when the exporter output changes, all footprints are rebuilt
+BUILD_VERSION = 2
+
+def padSpecs(layers):
+    '''
+    Return the pad specs of the pads placed on a list of layers.
+    The pad position is the midpoint of the edge the pad was generated from.
+    '''
+    specs = []
+
+    for i, layer in enumerate(layers):
+        for net in layer.getNets():
+            for pad in net.getPads():
+                edge, shift, width, height = net.fitRectPad(pad)
+                (x1, y1), (x2, y2) = edge.coords
+
+                specs.append({'layer': i, 'x': (x1 + x2) / 2, 'y': (y1 + y2) / 2, 'shift': shift, 'width': width, 'height': height})
+
+    return specs
+
+def resolveSpec(spec, base):
+    '''
+    Return a copy of a build spec with the relative file paths resolved against a base directory.
+    '''
+    spec = dict(spec)
+    spec['output'] = os.path.join(base, spec['output'])
+    spec['layers'] = [dict(l, filename=os.path.join(base, l['filename'])) for l in spec['layers']]
+
+    return spec
+
+def fingerprint(spec, hashes = None, base = ''):
+    '''
+    Return the fingerprint of a build spec.
+
+    @param hashes: Optional dictionary filename -> file hash, shared by the specs of one build.
+    @param base: Directory the relative paths of the spec refer to.
+    '''
+    if hashes == None:
+        hashes = {}
+
+    sources = []
+
+    for l in spec['layers']:
+        filename = os.path.join(base, l['filename'])
+
+        if filename not in hashes:
+            hashes[filename] = file_hash(filename)
+
+        sources.append(hashes[filename])
+
+    # the output location is the manifest key
+    settings = {k: v for k, v in spec.items() if k != 'output'}
+    data = json.dumps({'version': BUILD_VERSION, 'sources': sources, 'spec': settings}, sort_keys=True, separators=(',', ':'))
+
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def loadLayers(spec):
+    '''
+    Load the layers of a build spec.
+    '''
+    from GerberLayer import GerberLayer
+
+    return [GerberLayer(l.get('id', 'F.Cu'), filename=l['filename'], grid_size=l.get('grid_size')) for l in spec['layers']]
+
+def specPads(layers, spec):
+    '''
+    Generate the pads of a build spec on the loaded layers. The pads are not added to the layers,
+    loaded layers can be shared by several specs.
+
+    returns dictionary {layer: {net: [pad polygons]}} as used by ModuleExport.exportKiCadModuleVariants
+    '''
+    pads = {layer: {} for layer in layers}
+
+    for p in spec.get('pads', []):
+        layer = layers[p.get('layer', 0)]
+        net, _ = layer.closestNet(p['x'], p['y'])
+        edge, _ = net.closestEdge(p['x'], p['y'])
+        pads[layer].setdefault(net, []).append(net.generateRectPad(edge, shift=p.get('shift', 1), width=p.get('width', 0), height=p.get('height', 0.1)))
+
+    return pads
+
+def exportSpec(layers, spec, pads):
+    '''
+    Write the footprint of a build spec with the pads generated by specPads.
+    '''
+    import ModuleExport
+
+    variant = {
+        'filename': spec['output'],
+        'footprint_name': spec.get('footprint_name', 'EM-Structure'),
+        'description': spec.get('description', "EM Structure imported from Gerber file format."),
+        'tags': spec.get('tags', "em structure gerber"),
+        'pads': pads,
+    }
+
+    ModuleExport.exportKiCadModuleVariants(layers, [variant])
+
+def buildFootprint(spec):
+    '''
+    Load the layers of a build spec, place the pads and write the footprint.
+    '''
+    layers = loadLayers(spec)
+    exportSpec(layers, spec, specPads(layers, spec))
+
+def _loadManifest(filename):
+    if not os.path.exists(filename):
+        return {}
+
+    with open(filename) as f:
+        return json.load(f)
+
+def _saveManifest(filename, manifest):
+    # write to a temporary file first, an interrupted build keeps the old manifest
+    tmp = filename + '.tmp'
+
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    os.replace(tmp, filename)
+
+def isUpToDate(spec, entry, fp):
+    '''
+    Test if the output of a spec matches its manifest entry and the fingerprint.
+    '''
+    if (entry == None) or (entry.get('fingerprint') != fp):
+        return False
+
+    output = spec['output']
+
+    return os.path.exists(output) and (file_hash(output) == entry.get('content_hash'))
+
+def build(specs, manifest_file, force = False, base = ''):
+    '''
+    Build the footprints of a list of specs, skipping footprints with unchanged inputs.
+
+    @param specs: List of build specs.
+    @param manifest_file: JSON file storing the fingerprints and content hashes. Output paths are stored relative to it.
+    @param force: Rebuild all footprints.
+    @param base: Directory the relative paths of the specs refer to, e.g. the directory of the spec file. 
+        Defaults to the working directory.
+
+    returns tuple (built, skipped)
+    '''
+    manifest = _loadManifest(manifest_file)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    hashes = {}
+    built = 0
+    skipped = 0
+
+    for spec in specs:
+        # the fingerprint covers the spec as written, independent of the working directory
+        fp = fingerprint(spec, hashes, base)
+        spec = resolveSpec(spec, base)
+        key = os.path.relpath(os.path.abspath(spec['output']), manifest_dir)
+
+        if (not force) and isUpToDate(spec, manifest.get(key), fp):
+            skipped += 1
+            inst.count('build.skipped')
+            continue
+
+        with inst.span('Build.footprint'):
+            buildFootprint(spec)
+
+        manifest[key] = {'fingerprint': fp, 'content_hash': file_hash(spec['output'])}
+        _saveManifest(manifest_file, manifest)
+
+        built += 1
+        inst.count('build.built')
+
+    return (built, skipped)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the footprints of a spec file, skipping unchanged footprints.')
+    parser.add_argument('specs', help='JSON file with a list of build specs')
+    parser.add_argument('--manifest', '-m', help='Manifest file, defaults to <specs>.manifest.json')
+    parser.add_argument('--force', '-f', action='store_true', help='Rebuild all footprints')
+
+    args = parser.parse_args()
+
+    with open(args.specs) as f:
+        specs = json.load(f)
+
+    built, skipped = build(specs, args.manifest or os.path.splitext(args.specs)[0] + '.manifest.json', args.force, os.path.dirname(args.specs))
+    print('%d built, %d skipped' % (built, skipped))
@@ -4,47 +4,95 @@ Created on Feb 3, 2021
 @author: fgeissler
 '''
 
-import gerber
-import ezdxf
-import os
-from LayoutFile import LayoutFile
+import re
+from functools import partial
+from LayoutFile import LayoutFile, file_hash
 
+import numpy as np
+import shapely
 import shapely.ops as sop
 import shapely.geometry as geo
-import shapely.affinity as aff
+from shapely.strtree import STRtree
 
-import KicadModTree as kmt
-
-from math import sqrt, atan2, pi, inf
+from math import sqrt, atan2, pi, inf, nan
 
 from GerberNet import GerberNet
+from PadIndex import PadIndex
+import Instrumentation as inst
+
+# Layout file layer names used as KiCad layer id
+KICAD_LAYER_ID = re.compile(r'^((F|B)\.(Cu|Adhes|Paste|SilkS|Mask|CrtYd|Fab)|In\d+\.Cu|Edge\.Cuts)$')
+
+# STRtree predicates of (geometry, net) as predicates of (net, geometry), evaluated with the prepared net
+_NET_PREDICATES = {
+    'intersects': shapely.intersects,
+    'within': shapely.contains,
+    'contains': shapely.within,
+    'covered_by': shapely.covers,
+    'covers': shapely.covered_by,
+    'touches': shapely.touches,
+    'overlaps': shapely.overlaps,
+    'crosses': shapely.crosses,
+}
 
 class GerberLayer(object):
     '''
     GerberLayer class contains the geometric primitives of one gerber layer.
     '''
     
-    def __init__(self, id='F.Cu', arc_segments = 16, tolerance = 1e-6, color = '#20A020', filename = None):
+    def __init__(self, id='F.Cu', arc_segments = 16, tolerance = 1e-6, color = '#20A020', filename = None, progress = None, grid_size = None, 
+                 min_width = None, min_clearance = None):
         '''
         Initialize the layer using a gerber file.
+        
+        progress is an optional callback progress(done, total) passed to LayoutFile.read.
+        
+        grid_size enables the fixed precision mode, see LayoutFile. The cleanup unions run on the same grid.
+        
+        min_width and min_clearance enable the validation of the loaded nets, see validate. 
+        The result is stored in violations.
         '''
         self.arc_segments = arc_segments
         self.tolerance = tolerance
         self.color = color
         self.id = id
+        self.grid_size = grid_size
+        # Effective precision grid in mm, None for floating point
+        self.grid = None
+        self.name = None
+        self.filename = filename
+        # Hash of the source file when it was imported
+        self.sourceHash = None
+        self._nets = []
+        # Increased when the nets or the pads change, see DerivedLayer
+        self.netRevision = 0
+        self.padRevision = 0
+        # Geometry array of the net polygons, built on first use
+        self._geoms = None
+        self._netTree = None
+        # KiCad polygon nodes of the nets, built on first export
+        self._kicadNodes = None
+        # KiCad polygon nodes of the nets in the frame of their anchor pad, keyed by (net, pad)
+        self._anchorNodes = {}
+        # Callable returning the layer polygon, set while the nets are not loaded
+        self._source = None
+        self.padIndex = PadIndex()
+        self.min_width = min_width
+        self.min_clearance = min_clearance
+        # Result of the validation after loading: tuple (width violations, clearance violations) or None
+        self.violations = None
         
         if(filename != None):
-            lf = LayoutFile()
-            lf.read(filename, filename + ':')
+            lf = LayoutFile(grid_size)
+            lf.read(filename, filename + ':', progress)
             
-            poly = lf.get_layer_poly(lf.get_layer_names()[0])
-
-            if poly.geom_type == 'MultiPolygon':
-                self.nets = [GerberNet(p) for p in poly.geoms]
-            elif poly.geom_type == 'Polygon':
-                self.nets = [GerberNet(poly)]
-            else:
-                print("Only Polygon types allowed!")
+            self.sourceHash = file_hash(filename)
+            self.name = lf.get_layer_names()[0]
+            self.grid = lf.get_layer_grid(self.name)
+            self._source = partial(lf.get_layer_poly, self.name)
+            
+            # Load and cleanup
+            self.load()
             
 #             # Get file extension
 #             _, ext = os.path.splitext(filename)
@@ -73,14 +121,179 @@ class GerberLayer(object):
 #                 gbr.to_metric()
 #                 # Load primitives from file
 #                 self._loadFilePrimitives(gbr) 
-                 
-            # Cleanup
-            self._cleanupLayer()  
+    
+    def __getstate__(self):
+        # pickled for other processes: load the nets, the net index is rebuilt on demand
+        self.load()
+        
+        state = self.__dict__.copy()
+        state['_netTree'] = None
+        
+        return state
+    
+    @property
+    def nets(self):
+        # nets of a lazily created layer are loaded on first access
+        if self._source != None:
+            self.load()
+            
+        return self._nets
+    
+    @nets.setter
+    def nets(self, nets):
+        self._nets = nets
+        self._geoms = None
+        self._netTree = None
+        self._kicadNodes = None
+        self._anchorNodes = {}
+        self.netRevision += 1
+        
+    def load(self):
+        '''
+        Load the nets from the layout file layer and clean them up. 
+        Called on first access of the nets of a layer created by layersFromLayoutFile.
+        '''
+        if self._source == None:
+            return
+        
+        source = self._source
+        self._source = None
+        
+        # the layout file layer is already merged on the layer grid
+        self._loadLayerPoly(source())
+        self._cleanupLayer(merge = False)
+        self._validateLayer()
+        
+    def isLoaded(self):
+        return self._source == None
+    
+    def reload(self, filename = None, progress = None):
+        '''
+        Re-import the layer from a changed file. 
+        Nets with unchanged geometry (same hash) are kept including their pads. 
+        The pads of changed nets are regenerated on the best matching edge of the new geometry (the same or 
+        a collinear edge if it still exists), pads without an edge within the pad size are dropped.
+        
+        returns tuple (kept nets, new nets, moved pads, dropped pads)
+        '''
+        if filename == None:
+            filename = self.filename
+            
+        lf = LayoutFile(self.grid_size)
+        lf.read(filename, filename + ':', progress)
+        
+        # same layer of the file if it exists
+        names = lf.get_layer_names()
+        name = names[0]
+        
+        if (self.name != None) and (self.filename != None):
+            oldname = filename + ':' + self.name[len(self.filename) + 1:]
+            
+            if oldname in names:
+                name = oldname
+        
+        new = GerberLayer(self.id, self.arc_segments, self.tolerance, self.color, grid_size = self.grid_size)
+        new.grid = lf.get_layer_grid(name)
+        new._source = partial(lf.get_layer_poly, name)
+        
+        # match nets by geometry hash
+        old = {}
+        
+        for net in self.nets:
+            old.setdefault(net.getHash(), []).append(net)
+            
+        nets = []
+        changed = []
+        
+        for net in new.nets:
+            same = old.get(net.getHash())
+            
+            if same:
+                nets.append(same.pop(0))
+            else:
+                nets.append(net)
+                changed.append(net)
+                
+        moved, dropped = self._movePads([n for l in old.values() for n in l], changed)
+        
+        # swap in the new state at once
+        padIndex = PadIndex()
+        
+        for net in nets:
+            for pad in net.getPads():
+                padIndex.add(pad, net)
+                
+        self.filename = filename
+        self.sourceHash = file_hash(filename)
+        self.name = name
+        self.grid = new.grid
+        self.padIndex = padIndex
+        self.nets = nets
+        self._validateLayer()
+        
+        return (len(nets) - len(changed), len(changed), moved, dropped)
+    
+    def _movePads(self, oldNets, newNets):
+        '''
+        Regenerate the pads of removed nets on the best matching edge of the new nets within the pad size, see _matchEdge.
+        Return tuple (moved, dropped) pad counts.
+        '''
+        moved = 0
+        dropped = 0
+        pads = [(net, pad) for net in oldNets for pad in net.getPads()]
+        
+        if len(pads) == 0:
+            return (0, 0)
+        
+        if len(newNets) == 0:
+            return (0, len(pads))
+        
+        # edge index over all new nets
+        edges = [net.getEdges() for net in newNets]
+        owner = np.repeat(np.arange(len(newNets)), [len(e) for e in edges])
+        edges = np.concatenate(edges)
+        tree = STRtree(edges)
+        tolerance = max(self.tolerance, self.grid or 0)
+        
+        for net, pad in pads:
+            edge, shift, width, height = net.fitRectPad(pad)
+            
+            # snap distance: the pad size
+            c = pad.exterior.coords
+            size = max(geo.Point(c[0]).distance(geo.Point(c[1])), geo.Point(c[1]).distance(geo.Point(c[2])))
+            
+            # all edges within the snap distance, not only the nearest: the edges sharing a corner with 
+            # the old edge are at distance 0
+            idx = tree.query(edge, predicate='dwithin', distance=size)
+            
+            if len(idx) == 0:
+                dropped += 1
+                continue
+            
+            i = idx[_matchEdge(edge, edges[idx], tolerance)]
+            target = newNets[owner[i]]
+            target.addPad(target.generateRectPad(edges[i], shift, width, height))
+            moved += 1
+            
+        return (moved, dropped)
+        
+    def _loadLayerPoly(self, poly):
+        '''
+        Load the nets from a (multi) polygon of a layout file layer.
+        '''
+        if poly.geom_type in ('MultiPolygon', 'Polygon'):
+            polys = shapely.get_parts(poly)
+            self.nets = [GerberNet(p) for p in polys]
+            self._geoms = polys
+        else:
+            print("Only Polygon types allowed!")
         
     def _loadFilePrimitives(self, gbr):
         '''
         Load primitives from gerber file and convert to layer nets
         '''
+        import gerber
+        
         self.nets = []
         
         for p in gbr.primitives:
@@ -94,6 +307,8 @@ class GerberLayer(object):
         '''
         Load region from file and generte primitive polygon
         '''
+        import gerber
+        
         lines = []
         
         for p in reg.primitives:
@@ -115,40 +330,144 @@ class GerberLayer(object):
     def getID(self):
         return self.id
     
+    def getGeometryArray(self):
+        '''
+        Return the net polygons as geometry array (same order as the nets) for vectorized operations.
+        Rebuilt when the nets are replaced, polygons changed with GerberNet.setPolygon are not tracked.
+        '''
+        if self._geoms is None:
+            self._geoms = np.array([n.getPolygon() for n in self.nets], dtype=object)
+            
+        return self._geoms
+    
+    def _getNetTree(self):
+        if self._netTree is None:
+            self._netTree = STRtree(self.getGeometryArray())
+            
+        return self._netTree
+    
     def getMultiPolygon(self):
         '''
         Create a multi polygon object from all nets
         '''
-        polys = []
+        return shapely.multipolygons(self.getGeometryArray())
+    
+    def netAreas(self):
+        '''
+        Return the areas of all nets as array.
+        '''
+        return shapely.area(self.getGeometryArray())
+    
+    def invalidNets(self):
+        '''
+        Return the nets with invalid geometry (e.g. self intersections).
+        '''
+        valid = shapely.is_valid(self.getGeometryArray())
         
-        for p in self.nets:
-            polys.append(p.getPolygon())
-            
-        return geo.MultiPolygon(polys)
+        return [self.nets[i] for i in np.flatnonzero(~valid)]
     
-    def _cleanupLayer(self):
+    def _cleanupLayer(self, merge = True):
         '''
         Merge all overlapping and touching polygons to nets, remove all pads. The corrected polygons are oriented counter-clockwise.
         Must be performed after loading a file to assemble the nets.
-        '''
-        # Union all touching polygons
-        union = sop.unary_union(self.getMultiPolygon())
         
-        if union.geom_type == 'MultiPolygon':
+        merge = False skips the union for polygons that are already disjoint (e.g. a merged layout file layer).
+        '''
+        with inst.span('GerberLayer.cleanup'):
+            # Union all touching polygons
+            if merge:
+                polys = shapely.get_parts(shapely.unary_union(self.getGeometryArray(), grid_size=self.grid))
+            else:
+                polys = self.getGeometryArray()
+            
+            # The pads belong to the replaced nets
+            self.padIndex.clear()
+            
             # Orient polygons
-            self.nets = [GerberNet(geo.polygon.orient(poly)) for poly in union.geoms]
-        elif union.geom_type == 'Polygon':
-            # Orient polygon
-            self.nets = [GerberNet(geo.polygon.orient(union))]
+            polys = _orientPolygons(polys)
+            self.nets = [GerberNet(poly) for poly in polys]
+            self._geoms = polys
+                
+        inst.count('nets', len(self.nets))
+        inst.geometry('GerberLayer:' + self.id, self._geoms)
+    
+    def _validateLayer(self):
+        '''
+        Run the validation if a minimum width or clearance is set.
+        '''
+        if (self.min_width == None) and (self.min_clearance == None):
+            return
+        
+        self.violations = self.validate(self.min_width, self.min_clearance)
+        (widths, gaps) = self.violations
+        
+        if len(widths) + len(gaps) > 0:
+            print('WARN: %d features narrower than %s mm, %d gaps smaller than %s mm' % (len(widths), self.min_width, len(gaps), self.min_clearance))
+    
+    def validate(self, min_width = None, min_clearance = None):
+        '''
+        Find copper features narrower than min_width and gaps between nets smaller than min_clearance.
+        
+        The width check removes all features narrower than min_width with an opening (negative and positive buffer 
+        with mitred joins) of all nets at once, the remaining difference are the violations. 
+        The clearance check queries the net index for net pairs within min_clearance.
+        
+        returns tuple (width violations, clearance violations)
+            width violations: list of (net, polygon) with the narrow part of the net
+            clearance violations: list of (net, net, line, distance) with the shortest line between the nets
+        '''
+        with inst.span('GerberLayer.validate'):
+            return (self._widthViolations(min_width), self._clearanceViolations(min_clearance))
+            
+    def _widthViolations(self, min_width):
+        if (min_width == None) or (len(self.nets) == 0):
+            return []
+        
+        geoms = self.getGeometryArray()
+        r = min_width / 2
+        
+        opened = shapely.buffer(shapely.buffer(geoms, -r, join_style='mitre'), r, join_style='mitre')
+        
+        # the opening reproduces the edges of nets without narrow parts, only nets that lost area are compared
+        cand = np.flatnonzero(shapely.area(geoms) - shapely.area(opened) > self.tolerance * min_width)
+        narrow = shapely.difference(geoms[cand], opened[cand], grid_size=self.grid)
+        
+        # split into the separate narrow parts
+        parts, idx = shapely.get_parts(narrow, return_index=True)
+        
+        # drop numerical residue along the edges
+        keep = ~shapely.is_empty(shapely.buffer(parts, -self.tolerance))
+        
+        return [(self.nets[i], p) for i, p in zip(cand[idx[keep]], parts[keep])]
+    
+    def _clearanceViolations(self, min_clearance):
+        if (min_clearance == None) or (len(self.nets) == 0):
+            return []
+        
+        geoms = self.getGeometryArray()
+        
+        # net pairs within the clearance, each pair once
+        a, b = self._getNetTree().query(geoms, predicate='dwithin', distance=min_clearance)
+        pair = a < b
+        a = a[pair]
+        b = b[pair]
+        
+        lines = shapely.shortest_line(geoms[a], geoms[b])
+        dist = shapely.length(lines)
+        
+        return [(self.nets[i], self.nets[j], line, d) for i, j, line, d in zip(a, b, lines, dist)]
     
     def boundingBox(self):
         '''
         Return bounding box of the layer.
         (xmin, ymin, xmax, ymax)
         '''
-        mp = self.getMultiPolygon()
+        geoms = self.getGeometryArray()
+        
+        if len(geoms) == 0:
+            return (nan, nan, nan, nan)
         
-        return mp.bounds # (xmin, ymin, xmax, ymax)
+        return tuple(shapely.total_bounds(geoms).tolist()) # (xmin, ymin, xmax, ymax)
     
     def getNets(self):
         return self.nets
@@ -158,123 +477,329 @@ class GerberLayer(object):
         Find closest net to coordinates.
         Return tuple (net, dist)
         '''
-        mindist = inf
-        cnet = None
-            
-        pt = geo.Point(x, y)
-            
-        for n in self.nets:
-            dist = n.getPolygon().distance(pt)
-            
-            # find closest net
-            if(dist < mindist):
-                cnet = n
-                mindist = dist
-                
-        if cnet == None:
+        if len(self.nets) == 0:
             print('WARN: No nets in layer!')
-        else:
-            return (cnet, mindist)
+            return
+        
+        idx, dist = self._getNetTree().query_nearest(geo.Point(x, y), return_distance=True)
+        
+        # first net on equal distance
+        i = np.argmin(idx)
+        
+        return (self.nets[idx[i]], dist[i])
     
-    def _boundToKmtPoly(self, bound, layer, offset_x, offset_y):  
-        # get coordinates in (x, y) form
-        m = geo.mapping(bound)
-        c = m['coordinates']
+    def queryNets(self, geoms, predicate = 'intersects', distance = None):
+        '''
+        Find the nets satisfying a predicate with a list of geometries, e.g. vias overlapping the copper.
+        Return the index arrays (geometry index, net index) of all matching pairs.
+        '''
+        if len(self.nets) == 0:
+            return (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
         
-        # translate coordinates with offset
-        c_transl = []
+        test = _NET_PREDICATES.get(predicate)
         
-        for x, y in c:
-            c_transl.append([x + offset_x, -y - offset_y])
+        if test == None:
+            return self._getNetTree().query(geoms, predicate=predicate, distance=distance)
         
-        return kmt.Polygon(nodes=c_transl, layer=layer, width=0)
+        # candidates by envelope, the predicate is evaluated on the prepared net polygons
+        geoms = np.asarray(geoms, dtype=object)
+        geom, net = self._getNetTree().query(geoms)
+        prepared = np.array([n.getPrepared() for n in self.nets], dtype=object)
+        hit = test(prepared[net], geoms[geom])
         
-    def _polyToKmtPoly(self, poly, layer, offset_x, offset_y):
-        # orient polygon clock wise
-        poly = geo.polygon.orient(poly, 1)
+        return (geom[hit], net[hit])
+    
+    def addPad(self, net, pad):
+        '''
+        Add a pad polygon to a net of the layer and register it in the pad index.
+        '''
+        net.addPad(pad)
+        self.padIndex.add(pad, net)
+        self.padRevision += 1
         
-        # get outer ring
-        outer = self._boundToKmtPoly(poly.exterior, layer, offset_x, offset_y);
+    def removePad(self, pad):
+        '''
+        Remove a pad from the layer. The owning net is looked up in the pad index.
+        Return the net the pad was removed from or None if the pad is unknown.
+        '''
+        net = self.padIndex.remove(pad)
         
-        # reverse orientation (required by KMT)
-        poly = geo.polygon.orient(poly, -1)
+        if net != None:
+            net.removePad(pad)
+            self._anchorNodes.pop((net, pad), None)
+            self.padRevision += 1
+            
+        return net
+    
+    def padAt(self, x, y, maxdist=0):
+        '''
+        Find the pad at the coordinates.
+        Return tuple (pad, net) or (None, None) if no pad is hit.
+        '''
+        return self.padIndex.padAt(x, y, maxdist)
+    
+    def _polyToKmtNodes(self, poly):
+        '''
+        Convert a counter clockwise oriented polygon to the nodes of a KiCad polygon (y axis mirrored).
+        The voids are cut like KicadModTree's Polygon.cut does: the nearest points of the outline 
+        and the void are connected by two lines on top of each other.
+        '''
+        # get outer ring, mirror y
+        nodes = np.asarray(poly.exterior.coords) * (1, -1)
         
-        # cut internal voids
+        # cut internal voids, reverse orientation (required by KMT)
         for intr in poly.interiors:
-            p = self._boundToKmtPoly(intr, layer, offset_x, offset_y);
-            outer.cut(p)
+            void = np.asarray(intr.coords)[::-1] * (1, -1)
+            i, j = _nearestPoints(nodes, void)
+            m = len(void)
+            
+            nodes = np.concatenate((nodes[:i + 1], void[[j]], void[(j - 1 - np.arange(m)) % m], nodes[i:]))
             
-        return outer
+        return nodes
+    
+    def _getKicadNodes(self):
+        '''
+        Return the KiCad polygon nodes of all nets (without offset). Converted once and reused by every export.
+        '''
+        if self._kicadNodes == None:
+            # orient all polygons counter clockwise
+            polys = _orientPolygons(self.getGeometryArray())
+            self._kicadNodes = [self._polyToKmtNodes(poly) for poly in polys]
+            
+        return self._kicadNodes
         
+    def _polyToKmtPoly(self, poly, layer, offset_x, offset_y):
+        '''
+        Convert a counter clockwise oriented polygon.
+        '''
+        return _nodesToKmtPoly(self._polyToKmtNodes(poly), layer, offset_x, offset_y)
     
-    def appendKicadLayer(self, kicad_mod, mod_layer='F.Cu', offset_x = 0, offset_y = 0, startpad=1):
+    def _getAnchorNodes(self, i, anchor):
         '''
-        Write the layer to a kicad_mod object from the KicadModTree.
+        Return the KiCad polygon nodes of net i in the frame of its anchor pad: relative to the pad center 
+        and rotated back by the pad rotation. Cached per (net, anchor pad) for the pads placed on the layer, 
+        not for the pads passed to the export (variants, build jobs).
+        '''
+        net = self.nets[i]
+        nodes = self._anchorNodes.get((net, anchor))
+        
+        if nodes is None:
+            (px, py, _, _, rot) = _padFrame(anchor)
+            
+            # the y axis of the nodes is mirrored, the inverse pad rotation becomes a rotation by +rot
+            c = np.cos(np.radians(rot))
+            s = np.sin(np.radians(rot))
+            nodes = (self._getKicadNodes()[i] - (px, -py)) @ np.array([[c, s], [-s, c]])
+            
+            if any(pad is anchor for pad in net.getPads()):
+                self._anchorNodes[(net, anchor)] = nodes
+            
+        return nodes
+    
+    def getKicadPrimitives(self, startpad=1, pads = None, padNumbers = None):
+        '''
+        Return the contents of the layer as plain data for appendKicadPrimitives and the next free pad number.
+        
+        The list has one entry per net: ('poly', nodes) for nets without pads, ('pads', number, anchor nodes, 
+        [pad frames]) for nets with pads. The polygon and anchor nodes are converted in this process and cached 
+        on the layer, the list is cheap to send to a worker process. See appendKicadLayer for the arguments.
         '''
         n = startpad
+        primitives = []
         
         # iterate closed polygons
-        for net in self.nets:
-            #if len(net.getPads()) == 0:
+        for i, (net, nodes) in enumerate(zip(self.nets, self._getKicadNodes())):
+            netPads = net.getPads() if pads == None else pads.get(net, [])
+            
+            if len(netPads) == 0:
                 # no pad = poly primitive  
-                # get polygon object
-                poly = net.getPolygon();
-                
-                # convert to KMT polygon
-                kmt_poly = self._polyToKmtPoly(poly, mod_layer, offset_x, offset_y)
-                
-                # save
-                kicad_mod.append(kmt_poly)
-                
-            #else:
-                pads = net.getPads()
-#                 # first pad is anchor
-#                 anch = pads[0]
-#                 
-#                 # center point
-#                 (pxmin, pymin, pxmax, pymax) = anch.bounds
-#                 px = (pxmin + pxmax) / 2
-#                 py = (pymin + pymax) / 2
-#                 
-#                 # size and rotation
-#                 x1, y1 = anch.boundary.coords[0]
-#                 x2, y2 = anch.boundary.coords[1]
-#                 x3, y3 = anch.boundary.coords[2]
-#                 w = sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
-#                 h = sqrt((x2 - x3) ** 2 + (y2 - y3) ** 2)
-#                 rot = atan2((y1 - y2), (x1 - x2)) / pi * 180
-#                 
-#                 # set pad rotation and transform polygon accordingly
-#                 rot_poly = aff.rotate(net.getPolygon(), -rot, (px, py))
-#                 
-#                 # convert to KMT polygon
-#                 kmt_poly = self._polyToKmtPoly(rot_poly, mod_layer, -px, -py)
-#                 
-#                 # create pad
-#                 kicad_mod.append(kmt.Pad(number = n, type=kmt.Pad.TYPE_SMT, shape = kmt.Pad.SHAPE_CUSTOM, layers = [mod_layer], 
-#                                    at=[px + offset_x, -(py + offset_y)], size=[w, h], rotation=rot, primitives=[kmt_poly], anchor_shape=kmt.Pad.SHAPE_RECT))
-#                 
-                # other pads are simple squares
-                #for i in range(1, len(pads)):
-                for i in range( len(pads)):
-                    # center point
-                    (pxmin, pymin, pxmax, pymax) = pads[i].bounds
-                    px = (pxmin + pxmax) / 2 + offset_x
-                    py = -((pymin + pymax) / 2 + offset_y)
-                    
-                    # size and rotation
-                    x1, y1 = pads[i].boundary.coords[0]
-                    x2, y2 = pads[i].boundary.coords[1]
-                    x3, y3 = pads[i].boundary.coords[2]
-                    w = sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
-                    h = sqrt((x2 - x3) ** 2 + (y2 - y3) ** 2)
-                    rot = atan2((y1 - y2), (x1 - x2)) / pi * 180
-                    
-                    kicad_mod.append(kmt.Pad(number = n, type=kmt.Pad.TYPE_SMT, shape = kmt.Pad.SHAPE_RECT, layers = [mod_layer], 
-                                       at=[px, py], size=[w, h], rotation=rot))
+                primitives.append(('poly', nodes))
+                continue
+            
+            number = n if padNumbers == None else padNumbers[i]
+            
+            # first pad is anchor
+            primitives.append(('pads', number, self._getAnchorNodes(i, netPads[0]), [_padFrame(pad) for pad in netPads]))
+            
+            # increase pad number
+            n = n + 1
                 
-                # increase pad number
-                n = n + 1
+        return primitives, n
+    
+    def appendKicadLayer(self, kicad_mod, mod_layer='F.Cu', offset_x = 0, offset_y = 0, startpad=1, pads = None, padNumbers = None):
+        '''
+        Write the layer to a kicad_mod object from the KicadModTree.
+        
+        The first pad of a net is a custom pad containing the net polygon, all further pads on the same net
+        have the same pad number but are separate rectangular pads. Nets without pads are written as polygons.
+        pads optionally maps nets to the pad polygons written instead of the placed pads of the layer, 
+        nets missing in the mapping get no pads. padNumbers optionally lists the pad number of every net 
+        (e.g. shared by nets connected through vias, see Connectivity), otherwise the nets with pads are 
+        numbered from startpad.
+        '''
+        primitives, n = self.getKicadPrimitives(startpad, pads, padNumbers)
+        appendKicadPrimitives(kicad_mod, primitives, mod_layer, offset_x, offset_y)
                 
         return n
-        
\ No newline at end of file
+
+def appendKicadPrimitives(kicad_mod, primitives, mod_layer='F.Cu', offset_x = 0, offset_y = 0):
+    '''
+    Write the primitives of GerberLayer.getKicadPrimitives to a kicad_mod object from the KicadModTree.
+    '''
+    import KicadModTree as kmt
+    
+    for primitive in primitives:
+        if primitive[0] == 'poly':
+            kicad_mod.append(_nodesToKmtPoly(primitive[1], mod_layer, offset_x, offset_y))
+            continue
+        
+        (_, number, anchorNodes, frames) = primitive
+        
+        # first pad is anchor
+        (px, py, w, h, rot) = frames[0]
+        polygon = kmt.Polygon(nodes=anchorNodes.tolist(), width=0)
+        
+        kicad_mod.append(kmt.Pad(number = number, type=kmt.Pad.TYPE_SMT, shape = kmt.Pad.SHAPE_CUSTOM, layers = [mod_layer], 
+                                 at=[px + offset_x, -(py + offset_y)], size=[w, h], rotation=rot, 
+                                 primitives=[polygon], anchor_shape=kmt.Pad.ANCHOR_RECT))
+        
+        # other pads are simple rectangles
+        for (px, py, w, h, rot) in frames[1:]:
+            kicad_mod.append(kmt.Pad(number = number, type=kmt.Pad.TYPE_SMT, shape = kmt.Pad.SHAPE_RECT, layers = [mod_layer], 
+                                     at=[px + offset_x, -(py + offset_y)], size=[w, h], rotation=rot))
+
+def _nodesToKmtPoly(nodes, layer, offset_x, offset_y):
+    import KicadModTree as kmt
+    
+    # translate coordinates with offset
+    return kmt.Polygon(nodes=(nodes + (offset_x, -offset_y)).tolist(), layer=layer, width=0)
+
+def _matchEdge(edge, candidates, tolerance):
+    '''
+    Return the index of the candidate edge matching an edge best: collinear (including identical) edges 
+    first, then the smallest Hausdorff distance, then the longest overlap along the edge.
+    '''
+    (x1, y1), (x2, y2) = edge.coords
+    llen = sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+    ux = (x2 - x1) / llen
+    uy = (y2 - y1) / llen
+    
+    # end points of the candidates relative to the edge: distance from the edge line and position along the edge
+    c = shapely.get_coordinates(candidates).reshape(-1, 2, 2)
+    rx = c[:, :, 0] - x1
+    ry = c[:, :, 1] - y1
+    collinear = (np.abs(rx * uy - ry * ux) <= tolerance).all(axis=1)
+    along = rx * ux + ry * uy
+    overlap = np.clip(np.minimum(along.max(axis=1), llen) - np.maximum(along.min(axis=1), 0), 0, None)
+    hausdorff = shapely.hausdorff_distance(edge, candidates)
+    
+    return np.lexsort((-overlap, hausdorff, ~collinear))[0]
+
+def _padFrame(pad):
+    '''
+    Return center, size and rotation (px, py, w, h, rot) of a rectangular pad polygon, rot in degrees.
+    '''
+    (pxmin, pymin, pxmax, pymax) = pad.bounds
+    
+    x1, y1 = pad.boundary.coords[0]
+    x2, y2 = pad.boundary.coords[1]
+    x3, y3 = pad.boundary.coords[2]
+    w = sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
+    h = sqrt((x2 - x3) ** 2 + (y2 - y3) ** 2)
+    rot = atan2((y1 - y2), (x1 - x2)) / pi * 180
+    
+    return ((pxmin + pxmax) / 2, (pymin + pymax) / 2, w, h, rot)
+
+def _nearestPoints(a, b, block = 1 << 20):
+    '''
+    Return the indices (i, j) of the nearest points a[i], b[j] of two point arrays.
+    The first pair in row major order wins on equal distance. The distance matrix is computed in blocks of rows.
+    '''
+    rows = max(1, block // len(b))
+    best = (inf, 0, 0)
+    
+    for r in range(0, len(a), rows):
+        d = np.hypot(a[r:r + rows, None, 0] - b[None, :, 0], a[r:r + rows, None, 1] - b[None, :, 1])
+        k = np.argmin(d)
+        
+        if d.flat[k] < best[0]:
+            i, j = np.unravel_index(k, d.shape)
+            best = (d.flat[k], r + i, j)
+            
+    return best[1], best[2]
+
+def _orientPolygons(polys):
+    '''
+    Orient an array of polygons: exterior rings counter clockwise, interior rings clockwise.
+    '''
+    if hasattr(shapely, 'orient_polygons'):
+        return shapely.orient_polygons(polys)
+    
+    # shapely < 2.1
+    return np.array([geo.polygon.orient(p) for p in polys], dtype=object)
+
+def _layerId(name, default):
+    '''
+    Use the layout file layer name as KiCad layer id if it is one.
+    '''
+    if KICAD_LAYER_ID.match(name):
+        return name
+    
+    return default
+
+def layersFromLayoutFile(lf, layer_prefix = '', id = 'F.Cu', **kwargs):
+    '''
+    Create one GerberLayer per layout file layer. The union and cleanup of a layer 
+    is performed on first use of its nets, unused layers cost nothing.
+    
+    @param lf: The LayoutFile.
+    @param layer_prefix: The prefix of the layout file layer names, stripped to find the KiCad layer id.
+    @param id: The layer id used for layers that are not named like a KiCad layer.
+    @param kwargs: Further GerberLayer arguments.
+    '''
+    layers = []
+    
+    for name in lf.get_layer_names():
+        layer = GerberLayer(id=_layerId(name[len(layer_prefix):], id), grid_size=lf.grid_size, **kwargs)
+        layer.name = name
+        layer.grid = lf.get_layer_grid(name)
+        layer._source = partial(lf.get_layer_poly, name)
+        layers.append(layer)
+        
+    return layers
+
+def layersFromFile(filename, progress = None, grid_size = None, **kwargs):
+    '''
+    Parse a file once and create one GerberLayer per layer of the file. See layersFromLayoutFile.
+    grid_size enables the fixed precision mode, see LayoutFile.
+    '''
+    lf = LayoutFile(grid_size)
+    lf.read(filename, filename + ':', progress)
+    
+    layers = layersFromLayoutFile(lf, filename + ':', **kwargs)
+    sourceHash = file_hash(filename)
+    
+    for layer in layers:
+        layer.filename = filename
+        layer.sourceHash = sourceHash
+        
+    return layers
+
+def layerFromCoords(coords, ring_offsets, polygon_offsets, id = 'F.Cu', grid_size = None, **kwargs):
+    '''
+    Create a layer from polygon coordinate arrays without a file, see LayoutFile.add_coords. 
+    The union and cleanup are performed on first use of the nets like for a file.
+    '''
+    lf = LayoutFile(grid_size)
+    lf.add_coords(coords, ring_offsets, polygon_offsets, id)
+    
+    return layersFromLayoutFile(lf, id=id, **kwargs)[0]
+
+def layerFromWkb(wkb, id = 'F.Cu', offsets = None, grid_size = None, **kwargs):
+    '''
+    Create a layer from WKB polygons without a file, see LayoutFile.add_wkb and layerFromCoords.
+    '''
+    lf = LayoutFile(grid_size)
+    lf.add_wkb(wkb, id, offsets)
+    
+    return layersFromLayoutFile(lf, id=id, **kwargs)[0]
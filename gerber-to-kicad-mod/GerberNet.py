@@ -4,10 +4,14 @@ Created on Feb 3, 2021
 @author: fgeissler
 '''
 
+import hashlib
+import weakref
+import numpy as np
+import shapely
 import shapely.ops as sop
 import shapely.geometry as geo
-import shapely.affinity as aff
-from math import inf, sqrt
+from shapely.strtree import STRtree
+from math import sqrt
 
 class GerberNet(object):
     '''
@@ -25,17 +29,155 @@ class GerberNet(object):
         else:
             self.pads = pads
         
+        # generateRectPad parameters of the pads by id(pad): (weak reference to the pad, parameters)
+        self._padParams = {}
+            
+        self._clearCache()
+            
+    def _clearCache(self):
+        '''
+        Drop all data derived from the polygon.
+        '''
+        self._hash = None
+        self._edges = None
+        self._edgeTree = None
+        self._mesh = None
+        self._prepared = False
+        
+    def __getstate__(self):
+        # the spatial indices and the prepared state are not pickled, they are rebuilt on demand
+        state = self.__dict__.copy()
+        state['_edgeTree'] = None
+        state['_prepared'] = False
+        state['_padParams'] = {}
+        
+        return state
+        
     def getPolygon(self):
         return self.polygon
     
+    def setPolygon(self, polygon):
+        self.polygon = polygon
+        self._clearCache()
+        
+    def getHash(self):
+        '''
+        Return a hash of the net geometry. Independent of the ring start points and orientation.
+        '''
+        if self._hash == None:
+            wkb = shapely.to_wkb(shapely.normalize(self.polygon))
+            self._hash = hashlib.sha1(wkb).hexdigest()
+            
+        return self._hash
+    
+    def getPrepared(self):
+        '''
+        Return the polygon prepared for repeated predicates. 
+        Prepared on first use, a new polygon (setPolygon) is prepared again.
+        '''
+        if not self._prepared:
+            shapely.prepare(self.polygon)
+            self._prepared = True
+            
+        return self.polygon
+    
+    def getEdges(self):
+        '''
+        Return the boundary edges as array of LineStrings.
+        Exterior ring first, then the interior rings.
+        '''
+        if self._edges is None:
+            rings = [self.polygon.exterior] + list(self.polygon.interiors)
+            segs = []
+            
+            for ring in rings:
+                c = np.asarray(ring.coords)
+                segs.append(np.stack([c[:-1], c[1:]], axis=1))
+                
+            self._edges = shapely.linestrings(np.concatenate(segs))
+            
+        return self._edges
+    
+    def _getEdgeTree(self):
+        if self._edgeTree is None:
+            self._edgeTree = STRtree(self.getEdges())
+            
+        return self._edgeTree
+    
     def getPads(self):
         return self.pads
     
+    def getVertices(self):
+        '''
+        Return the vertex buffer of the net: the vertices of the exterior ring followed by the 
+        interior rings, without the closing vertices. (N, 2) float array.
+        '''
+        rings = [self.polygon.exterior] + list(self.polygon.interiors)
+        
+        return np.concatenate([np.asarray(ring.coords)[:-1] for ring in rings])
+    
+    def triangleMesh(self):
+        '''
+        Constrained, hole aware triangulation of the net polygon. The result is cached.
+        
+        returns tuple (vertices, triangles)
+            vertices is the (N, 2) vertex buffer, see getVertices
+            triangles is a (M, 3) int array of vertex indices
+        '''
+        if self._mesh is None:
+            vertices = self.getVertices()
+            
+            if hasattr(shapely, 'constrained_delaunay_triangles'):
+                tris = shapely.get_parts(shapely.constrained_delaunay_triangles(self.polygon))
+            else:
+                # shapely < 2.1: unconstrained, triangles crossing the boundary are lost
+                tris = [tri for tri in sop.triangulate(self.polygon) if tri.within(self.polygon)]
+                
+            if len(tris) == 0:
+                self._mesh = (vertices, np.zeros((0, 3), dtype=np.int64))
+                return self._mesh
+            
+            # closed triangle rings: 4 coordinates each
+            tcoords = shapely.get_coordinates(tris).reshape(-1, 4, 2)[:, :3].reshape(-1, 2)
+            
+            # map triangle corners to vertex buffer indices
+            _, inverse = np.unique(np.concatenate([vertices, tcoords]), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            vid = np.full(inverse.max() + 1, -1, dtype=np.int64)
+            vid[inverse[:len(vertices)]] = np.arange(len(vertices))
+            
+            self._mesh = (vertices, vid[inverse[len(vertices):]].reshape(-1, 3))
+            
+        return self._mesh
+    
     def triangulate(self):
-        triangles = sop.triangulate(self.polygon)
+        '''
+        Return the triangles of the constrained triangulation as list of polygons.
+        '''
+        vertices, triangles = self.triangleMesh()
+        
+        return list(shapely.polygons(vertices[triangles]))
+    
+    def triangleAreas(self):
+        '''
+        Return the area of every triangle of the mesh.
+        '''
+        vertices, triangles = self.triangleMesh()
+        a = vertices[triangles[:, 0]]
+        b = vertices[triangles[:, 1]]
+        c = vertices[triangles[:, 2]]
         
-        # remove traingles that are in polygon holes
-        return [tri for tri in triangles if tri.within(self.polygon)]
+        return np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) / 2
+    
+    def containsPoints(self, x, y):
+        '''
+        Test which points lie inside the net (boundary included) with the prepared polygon.
+        Return a bool array.
+        '''
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        
+        return shapely.intersects_xy(self.getPrepared(), x, y)
 
     def generateRectPad(self, edge, shift=1, width=0, height=0.1):
         '''
@@ -53,6 +195,8 @@ class GerberNet(object):
         
         returns pad poly
         '''
+        args = (edge, shift, width, height)
+        
         # coordinates and deltas
         x1, y1 = edge.coords[0]
         x2, y2 = edge.coords[1]
@@ -93,41 +237,98 @@ class GerberNet(object):
         #    c - nh + nw
         #    c - nh - nw
         #    c + nh - nw
-        return geo.Polygon([
+        pad = geo.Polygon([
             (cx + nhx + nwx, cy + nhy + nwy), 
             (cx - nhx + nwx, cy - nhy + nwy), 
             (cx - nhx - nwx, cy - nhy - nwy), 
             (cx + nhx - nwx, cy + nhy - nwy)
         ])
+        
+        # keep the parameters for reloads, dropped with the pad (e.g. the pad prototypes of the GUI)
+        key = id(pad)
+        params = self._padParams
+        params[key] = (weakref.ref(pad, lambda r: params.pop(key, None)), args)
+        
+        return pad
     
     def closestEdge(self, x, y):
-        boundary = self.polygon.boundary
-        mindist = inf
-        cline = None
-            
-        pt = geo.Point(x, y)
-            
-        if boundary.geom_type != "MultiLineString":
-            boundary = [boundary]
+        '''
+        Find the closest boundary edge using the edge index.
+        Return tuple (edge, dist)
+        '''
+        return self.closestEdgeTo(geo.Point(x, y))
+    
+    def closestEdgeTo(self, geom):
+        '''
+        Find the boundary edge closest to a geometry.
+        Return tuple (edge, dist)
+        '''
+        edges = self.getEdges()
+        
+        if len(edges) == 0:
+            print('WARN: No edges in net poly!')
+            return None
             
-        for bound in boundary:
-            for i in range(len(bound.coords) - 1):
-                line = geo.LineString([bound.coords[i], bound.coords[i + 1]])
-                dist = line.distance(pt)
-                
-                # find closest line
-                if(dist < mindist):
-                    cline = line
-                    mindist = dist
+        idx, dist = self._getEdgeTree().query_nearest(geom, return_distance=True)
+        
+        # equidistant edges: first edge along the boundary
+        i = np.argmin(idx)
+        
+        return (edges[idx[i]], dist[i])
+    
+    def fitRectPad(self, pad):
+        '''
+        Return the parameters of a pad created by generateRectPad. 
+        Pads of other sources (e.g. project files) are fitted from their polygon: the generating edge is the 
+        edge closest to the pad center, automatic width and height (0) are detected from the edge length.
+        
+        returns tuple (edge, shift, width, height)
+        '''
+        entry = self._padParams.get(id(pad))
+        
+        if (entry != None) and (entry[0]() is pad):
+            return entry[1]
+        
+        c = np.asarray(pad.exterior.coords)
+        height = sqrt((c[0][0] - c[1][0]) ** 2 + (c[0][1] - c[1][1]) ** 2)
+        width = sqrt((c[1][0] - c[2][0]) ** 2 + (c[1][1] - c[2][1]) ** 2)
+        
+        # generating edge: closest edge to the pad center
+        cx, cy = c[:4].mean(axis=0)
+        edge, _ = self.closestEdge(cx, cy)
+        
+        x1, y1 = edge.coords[0]
+        x2, y2 = edge.coords[1]
+        dx = (x2 - x1)
+        dy = (y2 - y1)
+        llen = sqrt(dx ** 2 + dy ** 2)
+        
+        # center offset along the edge normal in half pad heights
+        d = (dy * (cx - (x1 + x2) / 2) - dx * (cy - (y1 + y2) / 2)) / llen
+        shift = max(-1, min(1, int(round(d / (height / 2))))) if height > 0 else 0
+        
+        eps = 1e-9 * max(1, llen)
+        
+        if abs(width - llen) < eps:
+            if abs(height - width) < eps:
+                height = 0
                 
-        if cline == None:
-            print('WARN: No edges in net poly!')
-        else:
-            return (cline, mindist)
+            width = 0
+        
+        return (edge, shift, width, height)
         
     def addPad(self, poly):
         # add pad to pads list
         self.pads.append(poly)
         
+    def removePad(self, poly):
+        # remove pad from pads list (identity, not geometric equality)
+        for i in range(len(self.pads)):
+            if self.pads[i] is poly:
+                del self.pads[i]
+                return True
+            
+        return False
+        
         
         
\ No newline at end of file
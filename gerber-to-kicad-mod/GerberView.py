@@ -5,17 +5,14 @@ Created on Feb 4, 2021
 '''
 import tkinter as tk
 from tkinter import filedialog
-import shapely.ops as sop
-import shapely.geometry as geo
-import shapely.affinity as aff
-import KicadModTree as kmt
-from math import sqrt, atan2, pi
+import numpy as np
 import os
 
 from PlotWindow import PlotWindow
 import matplotlib.pyplot as plt
 
 from GerberLayer import GerberLayer
+import ModuleExport
 
 class GerberView(tk.Frame):
     def __init__(self, parent):
@@ -32,6 +29,7 @@ class GerberView(tk.Frame):
         ''' Drawing canvas '''
         self.dwgGerber = tk.Canvas(parent)
         self.dwgGerber.bind("<Button-1>", self.dwgGerberClick)
+        self.dwgGerber.bind("<Configure>", self.dwgGerberResize)
         self.dwgGerber.pack(pady=self.btnLoad.winfo_height(), fill=tk.BOTH, expand=tk.YES)
         
         ''' Filename '''
@@ -40,6 +38,15 @@ class GerberView(tk.Frame):
         ''' Gerber Object '''
         self.gbr = None
         
+        ''' Canvas items of the nets and pads '''
+        self.netItems = {}
+        self.padItems = []
+        
+        ''' View transformation, set by drawGerber '''
+        self.view_margin = 5
+        self.view_height = None
+        self.scale_x = None
+        
         self.pwnd = PlotWindow()
         
     ''' Load button click. Select the file name '''
@@ -54,7 +61,7 @@ class GerberView(tk.Frame):
         filename = filedialog.asksaveasfilename(initialfile='em-structure.kicad_mod', defaultextension=".kicad_mod",filetypes = (("KiCad Module","*.kicad_mod"),("All Files","*.*")))
         
         if os.access(os.path.dirname(filename), os.W_OK):
-            self.gbr.exportToKicadMod(filename)
+            ModuleExport.exportKiCadModule([self.gbr], filename)
         
     ''' Load button click. Select the file name '''
     def dwgGerberClick(self, event):
@@ -77,9 +84,35 @@ class GerberView(tk.Frame):
             return
 
         padPoly = net.generateRectPad(edge)
-        net.addPad(padPoly)
+        self.gbr.addPad(net, padPoly)
         
-        self.drawGerber()
+        # only the new pad is drawn
+        self.padItems.append(self.drawRegion(padPoly))
+        
+    def dwgGerberResize(self, event):
+        '''
+        Fit the drawn items to the new canvas size with a canvas transformation.
+        '''
+        if self.scale_x == None:
+            return
+        
+        (minx, miny, maxx, maxy) = self.gbr.boundingBox()
+        view_height = event.height - 2 * self.view_margin
+        view_width = event.width - 2 * self.view_margin
+        scale = min(view_width / (maxx - minx), view_height / (maxy - miny))
+        
+        if scale <= 0:
+            return
+        
+        # scale around the lower left corner of the view and move it to the new lower edge
+        f = scale / self.scale_x
+        self.dwgGerber.scale('all', self.view_margin, self.view_height + self.view_margin, f, f)
+        self.dwgGerber.move('all', 0, view_height - self.view_height)
+        
+        self.view_height = view_height
+        self.view_width = view_width
+        self.scale_x = scale
+        self.scale_y = scale
         
     def readGerber(self):
         if(self.filename == None):
@@ -87,10 +120,12 @@ class GerberView(tk.Frame):
         
         self.gbr = GerberLayer(filename=self.filename)
         
-        for poly in self.gbr._getMultiPolygon():
-            self.pwnd.plotPoly(poly)
+        for poly in self.gbr.getMultiPolygon().geoms:
+            self.pwnd.plotPoly(poly, self.gbr.getColor())
             
         self.pwnd.setViewport(*self.gbr.boundingBox())
+        
+        self.drawGerber()
             
     def drawGerber(self):
         if(self.gbr == None):
@@ -102,7 +137,6 @@ class GerberView(tk.Frame):
         (minx, miny, maxx, maxy) = self.gbr.boundingBox()
         
         # transformations
-        self.view_margin = 5
         self.view_height = self.dwgGerber.winfo_height() - 2 * self.view_margin
         self.view_width = self.dwgGerber.winfo_width() - 2 * self.view_margin
         self.translate_x = -minx
@@ -110,18 +144,32 @@ class GerberView(tk.Frame):
         self.scale_x = min(self.view_width / (maxx - minx), self.view_height / (maxy - miny))
         self.scale_y = self.scale_x
         
-        for poly in self.gbr._getMultiPolygon():
-            self.drawRegion(poly)
+        self.netItems = {}
+        self.padItems = []
+        
+        for net in self.gbr.getNets():
+            self.netItems[net] = self.drawRegion(net.getPolygon())
             
         for net in self.gbr.getNets():
             for pad in net.getPads():
-                self.drawRegion(pad)
+                self.padItems.append(self.drawRegion(pad))
         
     def getViewCoord(self, x, y):
         sx = (x + self.translate_x) * self.scale_x + self.view_margin
         sy = self.view_height - (y + self.translate_y) * self.scale_y + self.view_margin
         
         return (sx, sy)
+    
+    def getViewCoords(self, coords):
+        '''
+        Transform a coordinate sequence to the flat canvas coordinate list [sx0, sy0, sx1, sy1, ...].
+        '''
+        xy = np.asarray(coords)[:, :2]
+        sxy = np.empty_like(xy)
+        sxy[:, 0] = (xy[:, 0] + self.translate_x) * self.scale_x + self.view_margin
+        sxy[:, 1] = self.view_height - (xy[:, 1] + self.translate_y) * self.scale_y + self.view_margin
+        
+        return sxy.ravel().tolist()
         
     def getGerberCoord(self, sx, sy):
         x = (sx - self.view_margin) / self.scale_x - self.translate_x
@@ -133,22 +181,10 @@ class GerberView(tk.Frame):
         return d / self.scale_x
     
     def drawLine(self, l):
-        map = geo.mapping(l)
-        coords = ()
-        
-        for xy in map['coordinates']:
-            coords = coords + self.getViewCoord(*xy)
-        
-        self.dwgGerber.create_line(*coords, width = 2, fill = '#FF0000')
+        return self.dwgGerber.create_line(self.getViewCoords(l.coords), width = 2, fill = '#FF0000')
         
     def drawRegion(self, r):
-        map = geo.mapping(r)
-        coords = ()
-        
-        for xy in map['coordinates'][0]:
-            coords = coords + self.getViewCoord(*xy)
-        
-        self.dwgGerber.create_polygon(coords, outline='#000000', fill='#FFF0E0')
+        return self.dwgGerber.create_polygon(self.getViewCoords(r.exterior.coords), outline='#000000', fill='#FFF0E0')
 
 if __name__ == '__main__':
     root = tk.Tk()
@@ -0,0 +1,366 @@
+'''
+Timing spans, counters and memory accounting for the import and export pipeline.
+
+Disabled by default. Enable with enable() or the environment variable GERBER_KICAD_PROFILE:
+    GERBER_KICAD_PROFILE=1              print a summary table at exit
+    GERBER_KICAD_PROFILE=profile.json   write the results as JSON at exit
+
+The memory report is enabled with enable(memory=True) or GERBER_KICAD_MEMORY=1. It traces the
+Python allocations with tracemalloc, which slows down the pipeline considerably. Geometry held by
+GEOS is not visible to tracemalloc, its size is reported separately per layer.
+'''
+
+import os
+import sys
+import json
+import atexit
+import tracemalloc
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+ENV_VAR = 'GERBER_KICAD_PROFILE'
+ENV_VAR_MEMORY = 'GERBER_KICAD_MEMORY'
+
+# Approximate GEOS storage of one coordinate (x, y as double)
+COORD_BYTES = 16
+
+class _NullSpan(object):
+    '''
+    Span used while the instrumentation is disabled.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _Span(object):
+    '''
+    Timing span, records the elapsed time on exit.
+    '''
+    __slots__ = ('inst', 'name', 't0')
+
+    def __init__(self, inst, name):
+        self.inst = inst
+        self.name = name
+
+    def __enter__(self):
+        if self.inst.memory:
+            self.inst._memEnter(self.name)
+
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.inst._record(self.name, perf_counter() - self.t0)
+
+        if self.inst.memory:
+            self.inst._memExit()
+
+        return False
+
+class _Release(object):
+    '''
+    Measures the traced memory freed by the enclosed block (e.g. a del statement).
+    '''
+    __slots__ = ('inst', 'name', 'm0')
+
+    def __init__(self, inst, name):
+        self.inst = inst
+        self.name = name
+
+    def __enter__(self):
+        self.m0 = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc):
+        freed = self.m0 - tracemalloc.get_traced_memory()[0]
+        self.inst.releases.setdefault(self.name, []).append(freed)
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Instrumentation(object):
+    '''
+    Collects named timing spans and counters.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        # tracemalloc was started by enable()
+        self._tracing = False
+        self.output = None
+        self._atexit = False
+        self._memStack = []
+        self.clear()
+
+    def clear(self):
+        '''
+        Reset all recorded spans and counters.
+        '''
+        # name -> [calls, total, min, max]
+        self.spans = {}
+        # name -> value
+        self.counters = {}
+        # name -> [calls, max peak, total retained]
+        self.memSpans = {}
+        # name -> list of freed bytes
+        self.releases = {}
+        # name -> (coordinates, bytes)
+        self.geometries = {}
+
+    def enable(self, output = None, memory = False):
+        '''
+        Enable the instrumentation.
+
+        @param output: JSON file the results are written to at exit. None prints a summary table at exit, False disables the report at exit.
+        @param memory: Record the peak and retained memory of the spans.
+        '''
+        self.enabled = True
+        self.output = output
+
+        if memory and not self.memory:
+            self.memory = True
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+
+        if not self._atexit:
+            atexit.register(self._exitReport)
+            self._atexit = True
+
+    def disable(self):
+        self.enabled = False
+
+        if self.memory:
+            self.memory = False
+
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+    def span(self, name):
+        '''
+        Return a context manager that times the enclosed block.
+        '''
+        if not self.enabled:
+            return _NULL_SPAN
+
+        return _Span(self, name)
+
+    def release(self, name):
+        '''
+        Return a context manager that records the memory freed by the enclosed block.
+        Used to document that large intermediates are dropped after their stage.
+        '''
+        if not self.memory:
+            return _NULL_SPAN
+
+        return _Release(self, name)
+
+    def geometry(self, name, geom):
+        '''
+        Record the size of a geometry (or geometry array) held by GEOS.
+        '''
+        if not self.memory:
+            return
+
+        import numpy as np
+        import shapely
+
+        coords = int(np.sum(shapely.get_num_coordinates(geom)))
+
+        # several objects of the same name (e.g. layers with the same id)
+        key = name
+        i = 2
+
+        while key in self.geometries:
+            key = '%s (%d)' % (name, i)
+            i += 1
+
+        self.geometries[key] = (coords, coords * COORD_BYTES)
+
+    def _memEnter(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+
+        # propagate the peak to the enclosing spans before it is reset
+        for e in self._memStack:
+            e[2] = max(e[2], peak)
+
+        tracemalloc.reset_peak()
+        # name, start, peak
+        self._memStack.append([name, current, current])
+
+    def _memExit(self):
+        current, peak = tracemalloc.get_traced_memory()
+        name, start, epeak = self._memStack.pop()
+        epeak = max(epeak, peak)
+
+        if self._memStack:
+            self._memStack[-1][2] = max(self._memStack[-1][2], epeak)
+
+        m = self.memSpans.get(name)
+
+        if m == None:
+            self.memSpans[name] = [1, epeak - start, current - start]
+        else:
+            m[0] += 1
+            m[1] = max(m[1], epeak - start)
+            m[2] += current - start
+
+    def count(self, name, n = 1):
+        '''
+        Add n to a counter.
+        '''
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _record(self, name, dt):
+        s = self.spans.get(name)
+
+        if s == None:
+            self.spans[name] = [1, dt, dt, dt]
+        else:
+            s[0] += 1
+            s[1] += dt
+            s[2] = min(s[2], dt)
+            s[3] = max(s[3], dt)
+
+    def peakRss(self):
+        '''
+        Return the peak resident set size of the process in bytes or None if unknown.
+        '''
+        if resource == None:
+            return None
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # kilobytes on Linux, bytes on macOS
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+    def toDict(self):
+        '''
+        Return the results as JSON serializable dictionary.
+        '''
+        d = {
+            'spans': {k: {'calls': v[0], 'total': v[1], 'min': v[2], 'max': v[3]} for k, v in self.spans.items()},
+            'counters': dict(self.counters),
+        }
+
+        if self.memory:
+            d['memory'] = {
+                'spans': {k: {'calls': v[0], 'peak': v[1], 'retained': v[2]} for k, v in self.memSpans.items()},
+                'releases': {k: {'count': len(v), 'freed': sum(v)} for k, v in self.releases.items()},
+                'geometries': {k: {'coordinates': v[0], 'bytes': v[1]} for k, v in self.geometries.items()},
+                'peak_rss': self.peakRss(),
+            }
+
+        return d
+
+    def summary(self):
+        '''
+        Return the results as text table.
+        '''
+        lines = ['%-28s %8s %12s %12s' % ('span', 'calls', 'total (ms)', 'max (ms)')]
+
+        for k, v in sorted(self.spans.items(), key=lambda kv: -kv[1][1]):
+            lines.append('%-28s %8d %12.2f %12.2f' % (k, v[0], v[1] * 1e3, v[3] * 1e3))
+
+        if self.counters:
+            lines.append('')
+            lines.append('%-28s %8s' % ('counter', 'value'))
+
+            for k in sorted(self.counters.keys()):
+                lines.append('%-28s %8d' % (k, self.counters[k]))
+
+        if self.memory:
+            lines.append('')
+            lines.append('%-28s %8s %12s %12s' % ('memory span', 'calls', 'peak (KiB)', 'kept (KiB)'))
+
+            for k, v in sorted(self.memSpans.items(), key=lambda kv: -kv[1][1]):
+                lines.append('%-28s %8d %12.1f %12.1f' % (k, v[0], v[1] / 1024, v[2] / 1024))
+
+            if self.releases:
+                lines.append('')
+                lines.append('%-28s %8s %12s' % ('released', 'count', 'freed (KiB)'))
+
+                for k, v in self.releases.items():
+                    lines.append('%-28s %8d %12.1f' % (k, len(v), sum(v) / 1024))
+
+            if self.geometries:
+                lines.append('')
+                lines.append('%-28s %8s %12s' % ('geometry', 'coords', 'size (KiB)'))
+
+                for k, v in self.geometries.items():
+                    lines.append('%-28s %8d %12.1f' % (k, v[0], v[1] / 1024))
+
+            rss = self.peakRss()
+
+            if rss != None:
+                lines.append('')
+                lines.append('peak RSS: %.1f MiB' % (rss / 1024 / 1024,))
+
+        return '\n'.join(lines)
+
+    def report(self, output = None):
+        '''
+        Print the summary table or write the JSON results to output.
+        '''
+        if output:
+            with open(output, 'w') as f:
+                json.dump(self.toDict(), f, indent=2)
+        else:
+            print(self.summary(), file=sys.stderr)
+
+    def _exitReport(self):
+        if self.enabled and (self.output is not False):
+            self.report(self.output)
+
+# Module instance used by the pipeline
+_inst = Instrumentation()
+
+def enable(output = None, memory = False):
+    _inst.enable(output, memory)
+
+def disable():
+    _inst.disable()
+
+def isEnabled():
+    return _inst.enabled
+
+def isMemoryEnabled():
+    return _inst.memory
+
+def span(name):
+    return _inst.span(name)
+
+def count(name, n = 1):
+    _inst.count(name, n)
+
+def release(name):
+    return _inst.release(name)
+
+def geometry(name, geom):
+    _inst.geometry(name, geom)
+
+def clear():
+    _inst.clear()
+
+def toDict():
+    return _inst.toDict()
+
+def report(output = None):
+    _inst.report(output)
+
+_env = os.environ.get(ENV_VAR, '')
+_envMemory = os.environ.get(ENV_VAR_MEMORY, '') not in ('', '0')
+
+if (_env not in ('', '0')) or _envMemory:
+    enable(None if _env in ('', '0', '1') else _env, _envMemory)
@@ -4,109 +4,428 @@ Created on Feb 21, 2022
 @author: fgeissler
 '''
 
-import gerber
-import ezdxf
 import warnings
+import gc
+import hashlib
 import os.path as path
 
+import numpy as np
+import shapely
 import shapely.geometry as geo
 import shapely.ops as sop
 
-from numpy import poly
+import Instrumentation as inst
 
 # TODO: Separate Classes for the different file types
 
+def file_hash(filename):
+    '''
+    Return the SHA-256 hex digest of a file.
+    '''
+    h = hashlib.sha256()
+    
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+            
+    return h.hexdigest()
+
+class LoadCancelled(Exception):
+    '''
+    Raised by a progress callback to cancel reading a file.
+    '''
+    pass
+
+def _transform(vertices, m, convf):
+    '''
+    Transform (n, 3) DXF vertices with an ezdxf Matrix44 (None for identity) and scale them to mm.
+    Return the (n, 2) xy coordinates.
+    '''
+    if m != None:
+        mat = np.array(list(m.rows()))
+        vertices = vertices @ mat[:3, :3] + mat[3, :3]
+        
+    return vertices[:, :2] * convf
+
+# ezdxf path commands
+_LINE_TO = 1
+_CURVE3_TO = 2
+_CURVE4_TO = 3
+_MOVE_TO = 4
+
+def _flatten_path(vertices, commands, tolerance):
+    '''
+    Approximate an ezdxf path by a polyline.
+    
+    All segments are converted to cubic Bezier curves (lines and quadratic curves are degree 
+    elevated), the subdivision count of every curve follows from the chord tolerance 
+    (Wang's formula) and all curve points are evaluated at once.
+    
+    @param vertices: The (n, 2) control vertices of the path: start point, then per command the control points and end point.
+    @param commands: The path command codes.
+    @param tolerance: Maximum distance of the polyline from the curve.
+    '''
+    if len(commands) == 0:
+        return vertices[:1]
+    
+    # MOVE_TO starts a sub path, only closed single paths are expected
+    commands = np.where(commands == _MOVE_TO, _LINE_TO, commands)
+    
+    # index of the end point of every segment
+    nv = np.where(commands == _CURVE4_TO, 3, np.where(commands == _CURVE3_TO, 2, 1))
+    end = np.cumsum(nv)
+    start = end - nv
+    
+    p0 = vertices[start]
+    p3 = vertices[end]
+    c = vertices[np.minimum(start + 1, end)]
+    d = vertices[np.minimum(start + 2, end)]
+    
+    line = (commands == _LINE_TO)[:, None]
+    quad = (commands == _CURVE3_TO)[:, None]
+    
+    c1 = np.where(line, p0 + (p3 - p0) / 3, np.where(quad, p0 + 2 * (c - p0) / 3, c))
+    c2 = np.where(line, p0 + 2 * (p3 - p0) / 3, np.where(quad, p3 + 2 * (c - p3) / 3, d))
+    
+    # Wang's formula for cubic curves
+    dd = np.maximum(np.hypot(*(c2 - 2 * c1 + p0).T), np.hypot(*(p3 - 2 * c2 + c1).T))
+    n = np.maximum(np.ceil(np.sqrt(0.75 * dd / tolerance)), 1).astype(int)
+    n[line[:, 0]] = 1
+    
+    # curve parameters (0, 1] of all points
+    seg = np.repeat(np.arange(len(n)), n)
+    t = (np.arange(len(seg)) - np.repeat(np.cumsum(n) - n, n) + 1) / n[seg]
+    t = t[:, None]
+    u = 1 - t
+    
+    pts = u ** 3 * p0[seg] + 3 * u ** 2 * t * c1[seg] + 3 * u * t ** 2 * c2[seg] + t ** 3 * p3[seg]
+    
+    return np.concatenate([vertices[:1], pts])
+
 class LayoutFile:
     '''
     Read Layout file formats and provide the polygon data
     '''
-    def __init__(self):
+    def __init__(self, grid_size=None, chord_tolerance=1e-3):
+        '''
+        @param grid_size: Fixed precision grid in mm all geometry is snapped to and all unions run at. 
+            None keeps floating point coordinates. 'native' uses the coordinate grid of Gerber files 
+            (format specification and units), DXF files have no native grid and stay floating point.
+        @param chord_tolerance: Maximum deviation in mm of the polygon approximation of curved 
+            DXF boundaries (HATCH and SPLINE) from the curve.
+        '''
+        self.grid_size = grid_size
+        self.chord_tolerance = chord_tolerance
         self.clear()
         
     def clear(self):
         '''
         Clears the imported polygon data.
         '''
-        # Init layer dict
+        # Init layer dict, layer name -> polygon (None until the layer is merged)
         self.layers = {}
+        # Polygons not yet merged into the layers, layer name -> list of polygons
+        self.pending = {}
+        # Precision grid of the layers, layer name -> grid size in mm
+        self.grids = {}
+        # Precision grid of the file currently read
+        self._grid = None
+        # Boundary paths of the DXF entities read, entity handle -> list of (vertices, commands)
+        self._dxf_paths = {}
+        self.progress = None
     
-    def read(self, filename, layer_prefix=''):
+    def read(self, filename, layer_prefix='', progress=None):
         '''
         Read a file and append the layer data.
         
         @param filename: The path to the file.
         @param layer_prefix: The prefix for the layer name, so multiple files do not merge.
+        @param progress: Optional callback progress(done, total) called for every processed top level entity. 
+            It may raise LoadCancelled to abort reading.
         '''
         if not path.exists(filename):
             raise ValueError('Not an existing file name: %s' % (str(filename),))
         
         base, ext = path.splitext(filename)
         base = path.basename(base)
+        
+        self.progress = progress
+        
+        try:
+            with inst.span('LayoutFile.read'):
+                if ext == ".dxf":
+                    self._read_dxf(filename, layer_prefix)
+                elif (ext[0:2] == ".g") and (len(ext) == 4):
+                    warnings.warn('Assuming the extension "%s" to be a Gerber file.' % (ext,))
+                    self._read_gbr(filename, layer_prefix + base)
+                else:
+                    raise ValueError('Unknown file extension: "%s".\nKnown extensions: Gerber *.gXX, DXF *.dxf' % (ext,))
+        finally:
+            self.progress = None
+            self._grid = None
             
-        if ext == ".dxf":
-            self._read_dxf(filename, layer_prefix)
-        elif (ext[0:2] == ".g") and (len(ext) == 4):
-            warnings.warn('Assuming the extension "%s" to be a Gerber file.' % (ext,))
-            self._read_gbr(filename, layer_prefix + base)
-        else:
-            raise ValueError('Unknown file extension: "%s".\nKnown extensions: Gerber *.gXX, DXF *.dxf' % (ext,))
+    def add_coords(self, coords, ring_offsets, polygon_offsets, layer):
+        '''
+        Append polygons given as coordinate array to a layer, e.g. generated by a simulation script.
+        The arrays use the ragged array layout of shapely.from_ragged_array (GeoArrow). Arrays of the 
+        right type are passed to GEOS as they are, no intermediate Python objects are created.
+        
+        @param coords: (n, 2) float64 array of the ring vertices in mm, every ring closed.
+        @param ring_offsets: Index of the first vertex of every ring and the vertex count, length rings + 1.
+        @param polygon_offsets: Index of the first ring of every polygon and the ring count, length polygons + 1. 
+            The first ring of a polygon is the outline, the further rings are holes.
+        @param layer: The layer name.
+        '''
+        coords = np.ascontiguousarray(coords, dtype=np.float64)
+        offsets = (np.asarray(ring_offsets, dtype=np.int64), np.asarray(polygon_offsets, dtype=np.int64))
+        
+        with inst.span('LayoutFile.add'):
+            polys = shapely.from_ragged_array(shapely.GeometryType.POLYGON, coords, offsets)
+            self._add_polys(polys, layer)
+            
+    def add_wkb(self, wkb, layer, offsets=None):
+        '''
+        Append polygons given as WKB to a layer.
+        
+        @param wkb: A sequence of WKB (multi) polygons, or one buffer with the concatenated WKB of all polygons.
+        @param layer: The layer name.
+        @param offsets: Start of every polygon in the buffer and the buffer length, length polygons + 1. 
+            Required if wkb is one buffer.
+        '''
+        if offsets is not None:
+            buf = memoryview(wkb).cast('B')
+            wkb = [buf[offsets[i]:offsets[i + 1]].tobytes() for i in range(len(offsets) - 1)]
+            
+        with inst.span('LayoutFile.add'):
+            self._add_polys(shapely.from_wkb(wkb), layer)
+            
+    def _add_polys(self, polys, layer):
+        '''
+        Append an array of polygons to a layer. The polygons are merged with the layer like the polygons of a file.
+        '''
+        polys = np.asarray(polys, dtype=object).ravel()
+        
+        if not np.isin(shapely.get_type_id(polys), (shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON)).all():
+            raise ValueError('Only polygons and multi polygons can be added to a layer.')
+        if not layer:
+            raise ValueError('The parameter "layer" must be a valid layer name string!')
+        
+        inst.count('regions', len(polys))
+        inst.count('vertices', int(np.sum(shapely.get_num_coordinates(polys))))
+        
+        # self intersecting outlines, repaired before the union
+        invalid = ~shapely.is_valid(polys)
+        
+        if invalid.any():
+            polys = polys.copy()
+            polys[invalid] = shapely.make_valid(polys[invalid])
+        
+        if layer not in self.layers.keys():
+            self.layers[layer] = None
+            
+        if self.grid_size == 'native':
+            warnings.warn('In-memory geometry has no native coordinate grid, using floating point precision.')
+        elif self.grid_size:
+            polys = shapely.set_precision(polys, self.grid_size)
+            self.grids[layer] = max(self.grids.get(layer, 0), self.grid_size)
+            
+        self.pending.setdefault(layer, []).extend(polys)
+        
+    def _progress_iter(self, items, total):
+        '''
+        Iterate the items and report the progress after each processed item.
+        '''
+        if self.progress == None:
+            yield from items
+            return
+        
+        self.progress(0, total)
+        
+        for i, item in enumerate(items):
+            yield item
+            self.progress(i + 1, total)
             
     def _read_dxf(self, filename, layer_prefix):
         '''
         Read a dxf file.
         '''
-        dxfdoc = ezdxf.readfile(filename)
+        import ezdxf
+        
+        with inst.span('LayoutFile.parse_dxf'):
+            dxfdoc = ezdxf.readfile(filename)
+        
+        if self.grid_size == 'native':
+            warnings.warn('DXF files have no native coordinate grid, using floating point precision.')
+            self._grid = None
+        else:
+            self._grid = self.grid_size
         
         # Unit conversion
         unit = dxfdoc.units
         convf = ezdxf.units.conversion_factor(unit, ezdxf.units.MM)
         
         msp = dxfdoc.modelspace()
-        self._read_dxf_recurse(msp, convf, layer_prefix)
-            
-        for k in self.layers.keys():
-            print(k + ": " + str(self.layers[k]))
+        self._read_dxf_recurse(self._progress_iter(msp, len(msp)), convf, layer_prefix)
+        
+        self._dxf_paths = {}
+        
+        if inst.isMemoryEnabled():
+            # the document contains reference cycles, collect them to report the freed memory
+            with inst.release('LayoutFile.dxf_document'):
+                del msp, dxfdoc
+                gc.collect()
                 
-    def _read_dxf_recurse(self, entities, convf, pref):
+    def _read_dxf_recurse(self, entities, convf, pref, m=None):
         '''
         Recurse through dxf INSERTs (grouped entities).
+        
+        @param m: The transformation (ezdxf Matrix44) from the block coordinates to world coordinates, None for the modelspace.
         '''
         for e in entities:
             etype = e.dxftype()
+            inst.count('dxf.entities')
             
             if etype == 'INSERT':
-                self._read_dxf_recurse(e.virtual_entities(), convf, pref)
+                # MINSERT arrays are expanded to single INSERTs
+                for ins in e.multi_insert():
+                    block = ins.block()
+                    
+                    if block == None:
+                        continue
+                    
+                    # block transformation first, then the parent transformation
+                    mi = ins.matrix44() if m == None else ins.matrix44() @ m
+                    self._read_dxf_recurse(block, convf, pref, mi)
             elif etype == 'POLYLINE':
-                self._read_dxf_polyline(e, convf, pref)
+                self._read_dxf_polyline(e, convf, pref, m)
+            elif etype == 'HATCH':
+                self._read_dxf_hatch(e, convf, pref, m)
+            elif etype == 'SPLINE':
+                self._read_dxf_spline(e, convf, pref, m)
             else:
                 warnings.warn('Entity type %s not supported by DXF importer!' % (etype,))
     
-    def _read_dxf_polyline(self, ent, convf, pref):
+    def _read_dxf_polyline(self, ent, convf, pref, m=None):
         '''
         Generate a polygon from a dxf POLYLINE and union to layer.
+        The vertices of 2D polylines are in the object coordinate system (OCS) of the entity extrusion.
         '''
-        points = [[p.x * convf, p.y * convf] for p in ent.points()]
+        vertices = ent.points()
+        ocs = ent.ocs()
+        
+        if ent.is_2d_polyline and ocs.transform:
+            vertices = ocs.points_to_wcs(vertices)
+            
+        points = _transform(np.array([p.xyz for p in vertices]).reshape(-1, 3), m, convf)
+        inst.count('vertices', len(points))
         self._union_layer_poly(geo.Polygon(points), pref + ent.dxf.layer)
         
+    def _read_dxf_hatch(self, ent, convf, pref, m=None):
+        '''
+        Generate a polygon from the boundary paths of a dxf HATCH and union to layer.
+        Nested boundaries are filled alternately (even-odd rule), the hatch pattern is ignored.
+        '''
+        from ezdxf.path import from_hatch
+        
+        paths = self._dxf_entity_paths(ent, lambda: from_hatch(ent))
+        rings = [_flatten_path(_transform(v, m, convf), c, self.chord_tolerance) for v, c in paths]
+        rings = [r for r in rings if len(r) >= 3]
+        
+        if len(rings) == 0:
+            warnings.warn('HATCH without boundary paths skipped.')
+            return
+        
+        inst.count('vertices', sum(len(r) for r in rings))
+        
+        # boundary paths can self intersect
+        polys = shapely.make_valid(shapely.polygons([shapely.linearrings(r) for r in rings]))
+        poly = polys[0]
+        
+        for p in polys[1:]:
+            poly = shapely.symmetric_difference(poly, p)
+            
+        self._union_layer_poly(poly, pref + ent.dxf.layer)
+        
+    def _read_dxf_spline(self, ent, convf, pref, m=None):
+        '''
+        Generate a polygon from a closed dxf SPLINE and union to layer.
+        '''
+        from ezdxf.path import make_path
+        
+        (v, c), = self._dxf_entity_paths(ent, lambda: [make_path(ent)])
+        ring = _flatten_path(_transform(v, m, convf), c, self.chord_tolerance)
+        
+        if (len(ring) < 4) or not np.allclose(ring[0], ring[-1]):
+            warnings.warn('Open SPLINE skipped, only closed splines are imported.')
+            return
+        
+        inst.count('vertices', len(ring))
+        self._union_layer_poly(shapely.make_valid(geo.Polygon(ring)), pref + ent.dxf.layer)
+        
+    def _dxf_entity_paths(self, ent, make_paths):
+        '''
+        Return the ezdxf paths of an entity as list of (vertices, commands) arrays.
+        Cached per entity, the entities of a block are converted once for all INSERTs.
+        '''
+        paths = self._dxf_paths.get(ent.dxf.handle)
+        
+        if paths == None:
+            paths = [(np.array([v.xyz for v in p.control_vertices()]).reshape(-1, 3), np.array(p.command_codes(), dtype=int))
+                     for p in make_paths()]
+            self._dxf_paths[ent.dxf.handle] = paths
+        else:
+            inst.count('dxf.cached_paths')
+            
+        return paths
+        
     def _read_gbr(self, filename, layer):
         '''
         Read a Gerber file.
         '''
+        import gerber
+        
         # Parse gerber file
-        gbr = gerber.read(filename)
-        # Convert to metric units
-        gbr.to_metric()
+        with inst.span('LayoutFile.parse_gbr'):
+            gbr = gerber.read(filename)
+            
+            if self.grid_size == 'native':
+                self._grid = self._gbr_grid(gbr)
+            else:
+                self._grid = self.grid_size
+            
+            # Convert to metric units
+            gbr.to_metric()
         # read file contents
-        self._read_gbr_recurse(gbr.primitives, layer)
+        self._read_gbr_recurse(self._progress_iter(gbr.primitives, len(gbr.primitives)), layer)
+        
+        if inst.isMemoryEnabled():
+            # report the memory of the parsed primitives, dropped as soon as the polygons are extracted
+            with inst.release('LayoutFile.gbr'):
+                del gbr
+        
+    def _gbr_grid(self, gbr):
+        '''
+        Return the coordinate grid of a gerber file in mm. Must be called before the unit conversion.
+        '''
+        _, decimals = gbr.settings.format
+        grid = 10.0 ** -decimals
+        
+        if gbr.settings.units == 'inch':
+            grid *= 25.4
+            
+        return grid
         
     def _read_gbr_recurse(self, primitives, layer):
         '''
         Recurse through gerber primitives.
         '''
+        from gerber.primitives import Region
+        
         for p in primitives:
             ptype = type(p)
+            inst.count('gbr.primitives')
             
-            if ptype == gerber.primitives.Region:
+            if ptype == Region:
                 self._read_gbr_region(p, layer)
             else:
                 warnings.warn('Gerber primitive type %s not supported by Gerber importer!' % (str(ptype),))
@@ -115,32 +434,63 @@ class LayoutFile:
         '''
         Read a gerber region.
         '''
+        from gerber.primitives import Line
+        
         points = []
+        inst.count('gbr.regions')
         
         for p in reg.primitives:
             ptype = type(p)
             
-            if ptype == gerber.primitives.Line:
+            if ptype == Line:
                 points.append((p.start, p.end))
             else:
                 warnings.warn('Gerber region primitive type %s not supported by Gerber importer!' % (str(ptype),))
         
-        for poly in sop.polygonize(points):
+        inst.count('vertices', len(points))
+        
+        with inst.span('LayoutFile.polygonize'):
+            polys = sop.polygonize(points)
+        
+        for poly in polys:
             self._union_layer_poly(poly, layer)
         
     def _union_layer_poly(self, poly, layer):
         '''
         Union a polygon to the specified layer.
+        The union is deferred until the layer polygon is requested, then all polygons of the layer are merged at once.
         '''
         if poly is None:
             raise ValueError('The parameter "poly" must be a valid shapely Polygon object!')
         if not layer:
             raise ValueError('The parameter "layer" must be a valid layer name string!')
         
-        if layer in self.layers.keys():
-            self.layers[layer] = poly.union(self.layers[layer])
-        else:
-            self.layers[layer] = poly
+        if layer not in self.layers.keys():
+            self.layers[layer] = None
+        
+        if self._grid:
+            # snap to the grid, the layer keeps the coarsest grid of its files
+            poly = shapely.set_precision(poly, self._grid)
+            self.grids[layer] = max(self.grids.get(layer, 0), self._grid)
+        
+        self.pending.setdefault(layer, []).append(poly)
+        
+    def _merge_layer(self, layer):
+        '''
+        Union the pending polygons of a layer.
+        '''
+        polys = self.pending.pop(layer, None)
+        
+        if polys == None:
+            return
+        
+        if self.layers[layer] != None:
+            polys.append(self.layers[layer])
+        
+        with inst.span('LayoutFile.union'):
+            self.layers[layer] = shapely.unary_union(polys, grid_size=self.grids.get(layer))
+            
+        inst.geometry('LayoutFile:' + layer, self.layers[layer])
 
     def get_layer_names(self):
         '''
@@ -148,18 +498,31 @@ class LayoutFile:
         '''
         return list(self.layers.keys())
 
+    def get_layer_grid(self, layer):
+        '''
+        Return the precision grid size of a layer in mm or None for floating point precision.
+        
+        @param layer: The layer identifier.
+        '''
+        return self.grids.get(layer)
+    
     def get_layer_poly(self, layer):
         '''
         Return the Polygon of a specific layer.
         
         @param layer: The layer identifier.
         '''
+        self._merge_layer(layer)
+        
         return self.layers[layer]
     
     def get_layers(self):
         '''
         Return the layers as dictionary.
         '''
+        for k in self.layers.keys():
+            self._merge_layer(k)
+            
         return self.layers
 
 if __name__ == '__main__':
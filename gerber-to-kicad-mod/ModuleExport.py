@@ -0,0 +1,177 @@
+'''
+Export of GerberLayers to KiCad footprint (kicad_mod) files.
+'''
+
+import io
+
+import Instrumentation as inst
+
+def layersBoundingBox(layers):
+    '''
+    Return the common bounding box of all layers.
+    (xmin, ymin, xmax, ymax)
+    '''
+    boxes = [layer.boundingBox() for layer in layers]
+
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+def exportKiCadModule(layers, filename, footprint_name = 'EM-Structure', description="EM Structure imported from Gerber file format.", tags="em structure gerber", bbox = None, workers = None, connectivity = None):
+    '''
+    Write the layers to a kicad_mod file.
+
+    @param layers: List of GerberLayer objects.
+    @param filename: The path of the output file.
+    @param bbox: The bounding box (xmin, ymin, xmax, ymax) the footprint is centered on. Defaults to the bounding box of all layers.
+    @param workers: Number of worker processes converting the layers in parallel. None or 1 converts the layers serially.
+    @param connectivity: Optional Connectivity of the layers, nets connected through vias get the same pad number.
+    '''
+    variant = {'filename': filename, 'footprint_name': footprint_name, 'description': description, 'tags': tags}
+
+    exportKiCadModuleVariants(layers, [variant], bbox, workers, connectivity)
+
+def exportKiCadModuleVariants(layers, variants, bbox = None, workers = None, connectivity = None):
+    '''
+    Write several footprints of the same layers, e.g. with different port sets or layer mappings.
+    The net polygons are converted once and reused by all variants.
+
+    @param layers: List of GerberLayer objects.
+    @param variants: List of dictionaries with the keys
+        filename: The path of the output file (required).
+        footprint_name, description, tags: As for exportKiCadModule.
+        pads: Dictionary {layer: {net: [pad polygons]}} replacing the placed pads of the listed layers.
+        layer_map: Dictionary {layer id: KiCad layer} for layers written to another KiCad layer.
+        offset: (x, y) shift of the footprint contents in KiCad coordinates.
+    @param bbox: The bounding box (xmin, ymin, xmax, ymax) the footprints are centered on. Defaults to the bounding box of all layers.
+    @param workers: Number of worker processes converting the layers in parallel, see exportKiCadModule.
+    @param connectivity: Optional Connectivity of the layers, see exportKiCadModule.
+    '''
+    if bbox == None:
+        bbox = layersBoundingBox(layers)
+
+    executor = None
+
+    if (workers != None) and (workers > 1) and (len(layers) > 1):
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(min(workers, len(layers)))
+
+    try:
+        for variant in variants:
+            with inst.span('Export.variant'):
+                _writeVariant(layers, variant, bbox, executor, connectivity)
+
+            inst.count('variants')
+    finally:
+        if executor != None:
+            executor.shutdown()
+
+def _layerFragments(primitives, mod_layer, offset_x, offset_y):
+    '''
+    Worker process: convert the primitives of one layer (see GerberLayer.getKicadPrimitives) and return 
+    the serialized pads and polygons as tuple of strings.
+    '''
+    import KicadModTree as kmt
+    from GerberLayer import appendKicadPrimitives
+
+    mod = kmt.Footprint('')
+    appendKicadPrimitives(mod, primitives, mod_layer=mod_layer, offset_x = offset_x, offset_y = offset_y)
+
+    # body between the module header line and the closing bracket, nodes grouped by type
+    lines = kmt.KicadFileHandler(mod).serialize().split('\n')[1:-1]
+    padLines = []
+    polyLines = []
+    target = padLines
+
+    for line in lines:
+        if line.startswith('  (pad'):
+            target = padLines
+        elif line.startswith('  (fp_poly'):
+            target = polyLines
+
+        target.append(line + '\n')
+
+    return (''.join(padLines), ''.join(polyLines))
+
+def _countPads(layer, layerPads):
+    '''
+    Count the pads of a layer, return the number of pad numbers used (nets with pads).
+    '''
+    if layerPads == None:
+        netPads = [net.getPads() for net in layer.getNets()]
+    else:
+        netPads = [layerPads.get(net, []) for net in layer.getNets()]
+
+    inst.count('pads', sum(len(p) for p in netPads))
+
+    return sum(1 for p in netPads if len(p) > 0)
+
+def _writeVariant(layers, variant, bbox, executor = None, connectivity = None):
+    import KicadModTree as kmt
+
+    footprint_name = variant.get('footprint_name', 'EM-Structure')
+    pads = variant.get('pads', {})
+    layer_map = variant.get('layer_map', {})
+    (dx, dy) = variant.get('offset', (0, 0))
+
+    mod = kmt.Footprint(footprint_name)
+    mod.setDescription(variant.get('description', "EM Structure imported from Gerber file format."))
+    mod.setTags(variant.get('tags', "em structure gerber"))
+
+    # set general values
+    mod.append(kmt.Text(type='reference', text='REF**', at=[0, -3], layer='F.SilkS'))
+    mod.append(kmt.Text(type='value', text=footprint_name, at=[1.5, 3], layer='F.Fab'))
+
+    # create silscreen
+    #mod.append(kmt.RectLine(start=[-2, -2], end=[5, 2], layer='F.SilkS'))
+
+    (minx, miny, maxx, maxy) = bbox
+    w = maxx - minx
+    h = maxy - miny
+    ox = - maxx + w/2 + dx
+    oy = - maxy + h/2 - dy
+
+    # create courtyard
+    mod.append(kmt.RectLine(start=[-w/2 + dx, -h/2 + dy], end=[w/2 + dx, h/2 + dy], layer='F.CrtYd'))
+    #mod.append(kmt.FilledRect(start=[-w/2, -h/2], end=[w/2, h/2], layer='F.Mask'))
+
+    n = 1
+
+    # pad numbers shared by the nets connected through vias
+    numbers = connectivity.padNumbers(pads) if connectivity != None else {}
+
+    if executor != None:
+        # the nodes are converted and cached here, shared by all variants and exports,
+        # the workers only get the primitives instead of the pickled layers
+        futures = []
+
+        for layer in layers:
+            primitives, n = layer.getKicadPrimitives(startpad=n, pads=pads.get(layer), padNumbers=numbers.get(layer))
+            futures.append(executor.submit(_layerFragments, primitives, layer_map.get(layer.getID(), layer.getID()), ox, oy))
+            _countPads(layer, pads.get(layer))
+
+        with inst.span('Export.convert_layers_parallel'):
+            fragments = [f.result() for f in futures]
+
+        # the serializer writes all pads before all polygons, the footprint ends with the closing bracket
+        with inst.span('Export.serialize'):
+            text = kmt.KicadFileHandler(mod).serialize()
+            text = text[:-1] + ''.join(f[0] for f in fragments) + ''.join(f[1] for f in fragments) + text[-1:]
+
+            with io.open(variant['filename'], 'w', newline='\n') as f:
+                f.write(text)
+
+        return
+
+    # iterate layers
+    for layer in layers:
+        layerPads = pads.get(layer)
+
+        with inst.span('Export.convert_layer'):
+            n = layer.appendKicadLayer(mod, mod_layer=layer_map.get(layer.getID(), layer.getID()), offset_x = ox, offset_y = oy, startpad=n, pads=layerPads, padNumbers=numbers.get(layer))
+
+        _countPads(layer, layerPads)
+
+    # output kicad model
+    with inst.span('Export.serialize'):
+        file_handler = kmt.KicadFileHandler(mod)
+        file_handler.writeFile(variant['filename'])
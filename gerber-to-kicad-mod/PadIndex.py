@@ -0,0 +1,114 @@
+'''
+Spatial index of the pads of a layer for hover hit-testing and pad removal.
+'''
+
+import shapely.geometry as geo
+from shapely.strtree import STRtree
+
+class PadIndex(object):
+    '''
+    Spatial index over the pads of a layer. Maps every pad polygon to the net it belongs to.
+    '''
+
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        self.clear()
+
+    def clear(self):
+        '''
+        Remove all pads from the index.
+        '''
+        # pad id -> (pad, net)
+        self.entries = {}
+        self._tree = None
+        self._treeKeys = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # the entries are keyed by object id, the tree is rebuilt on demand
+        return list(self.entries.values())
+
+    def __setstate__(self, state):
+        self.clear()
+
+        for pad, net in state:
+            self.add(pad, net)
+
+    def add(self, pad, net):
+        '''
+        Add a pad of a net to the index.
+        '''
+        self.entries[id(pad)] = (pad, net)
+        self._tree = None
+
+    def remove(self, pad):
+        '''
+        Remove a pad from the index.
+        Return the net the pad belonged to or None if the pad is unknown.
+        '''
+        entry = self.entries.pop(id(pad), None)
+
+        if entry == None:
+            return None
+
+        self._tree = None
+
+        return entry[1]
+
+    def getNet(self, pad):
+        '''
+        Return the net of a pad or None if the pad is unknown.
+        '''
+        entry = self.entries.get(id(pad))
+
+        if entry == None:
+            return None
+
+        return entry[1]
+
+    def _getTree(self):
+        '''
+        Return the STR tree of all pads. The tree is rebuilt lazily after pads were added or removed.
+        '''
+        if self._tree == None:
+            self._treeKeys = list(self.entries.keys())
+            self._tree = STRtree([self.entries[k][0] for k in self._treeKeys])
+
+        return self._tree
+
+    def padAt(self, x, y, maxdist=0):
+        '''
+        Find the pad at the coordinates. Pads within maxdist are hit as well.
+        Return tuple (pad, net) or (None, None) if no pad is hit.
+        '''
+        if len(self.entries) == 0:
+            return None, None
+
+        pt = geo.Point(x, y)
+        tree = self._getTree()
+
+        if maxdist > 0:
+            idx = tree.query(pt, predicate='dwithin', distance=maxdist)
+        else:
+            idx = tree.query(pt, predicate='intersects')
+
+        if len(idx) == 0:
+            return None, None
+
+        # prefer the pad closest to the point (overlapping pads)
+        mindist = None
+        hit = None
+
+        for i in idx:
+            pad, net = self.entries[self._treeKeys[i]]
+            dist = pad.distance(pt)
+
+            if (mindist == None) or (dist < mindist):
+                mindist = dist
+                hit = (pad, net)
+
+        return hit
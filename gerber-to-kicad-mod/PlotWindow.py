@@ -7,22 +7,15 @@ Created on Feb 6, 2021
 '''
 
 '''
-TODO: delete pads
 TODO: multiple layers
 '''
 
 # matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.widgets as wid
-import matplotlib.colors as col
 import matplotlib as mpl
 from matplotlib.backend_bases import MouseButton
 
-# shapely
-import shapely.ops as sop
-import shapely.geometry as geo
-import shapely.affinity as aff
-
 # descartes
 from descartes.patch import PolygonPatch
 
@@ -31,17 +24,25 @@ from tkinter import filedialog
 import tkinter as tk
 
 import os
+import argparse
+import threading
+import queue
 from GerberLayer import GerberLayer
+from LayoutFile import LoadCancelled
+import ModuleExport
+import ProjectFile
 
 from math import sqrt
-import KicadModTree as kmt
 
 class PlotWindow(object):
     MOUSE_NONE = 0
     MOUSE_PAN = 1
     MOUSE_DRAG = 2
     
-    def __init__(self):
+    def __init__(self, min_width = None, min_clearance = None):
+        '''
+        min_width and min_clearance enable the validation of loaded layers, violations are highlighted.
+        '''
         # Disable default Toolbar and enable interactive mode
         mpl.rcParams['toolbar'] = 'None'
         plt.ion()
@@ -89,6 +90,35 @@ class PlotWindow(object):
         self.theight = wid.TextBox(self.theightAx, 'Pad H', initial=str(self.padHeight))
         self.theight.on_submit(self._theightSubmit)
         
+        # Load progress and cancel button (visible while loading)
+        self.loadText = self.fig.text(0.01, 0.02, '')
+        self.bcancelAx = self.fig.add_axes([0.85, 0.01, 0.14, 0.06])
+        self.bcancel = wid.Button(self.bcancelAx, 'Cancel')
+        self.bcancel.on_clicked(self._bcancelClick)
+        self.bcancelAx.set_visible(False)
+        
+        # Project Buttons
+        self.bopenAx = self.fig.add_axes([0.40, 0.01, 0.14, 0.06])
+        self.bopen = wid.Button(self.bopenAx, 'Open Project')
+        self.bopen.on_clicked(self._bopenClick)
+        
+        self.bprojAx = self.fig.add_axes([0.55, 0.01, 0.14, 0.06])
+        self.bproj = wid.Button(self.bprojAx, 'Save Project')
+        self.bproj.on_clicked(self._bprojClick)
+        
+        # Reload Button
+        self.breloadAx = self.fig.add_axes([0.70, 0.01, 0.14, 0.06])
+        self.breload = wid.Button(self.breloadAx, 'Reload')
+        self.breload.on_clicked(self._breloadClick)
+        
+        # Background loader
+        self.loadThread = None
+        self.loadCancel = threading.Event()
+        self.loadResult = queue.Queue()
+        self.loadProgress = (0, 0)
+        self.loadTimer = self.fig.canvas.new_timer(interval=100)
+        self.loadTimer.add_callback(self._loadPoll)
+        
         # Layers
         self.gerberLayers = []
         self.activeLayer = None
@@ -96,8 +126,18 @@ class PlotWindow(object):
         # Patches
         self.polyPatches = []
         
+        # Pad patches by pad id
+        self.padPatches = {}
+        
+        # Validation
+        self.minWidth = min_width
+        self.minClearance = min_clearance
+        self.violationPatches = []
+        
         # Highlight shape
         self.highlight = None
+        # Pad under the cursor
+        self.hoverPad = None
         
         # Mouse position
         self.mouseDownX = 0
@@ -117,6 +157,9 @@ class PlotWindow(object):
         self.fig.canvas.mpl_connect('button_release_event', self._mouseUp)
         self.fig.canvas.mpl_connect('motion_notify_event', self._mouseMove)
         self.fig.canvas.mpl_connect('scroll_event', self._mouseScroll)
+        
+        # Key events
+        self.fig.canvas.mpl_connect('key_press_event', self._keyPress)
     
     def _twidthSubmit(self, text):
         self.padWidth = float(text)
@@ -125,14 +168,159 @@ class PlotWindow(object):
         self.padHeight = float(text)
     
     def _bloadClick(self, event):
+        # one file at a time
+        if self.loadThread != None:
+            return
+        
         fname = filedialog.askopenfilename()
         
         if os.path.exists(fname):
-            self.gerberLayers.append(GerberLayer(filename = fname))
-            self.generateLayers()
+            self.loadFile(fname)
+            
+    def _bopenClick(self, event):
+        if self.loadThread != None:
+            return
+        
+        filename = filedialog.askopenfilename(filetypes = (("Project","*.gkmproj"),("All Files","*.*")))
+        
+        if os.path.exists(filename):
+            self.openProject(filename)
+    
+    def _bprojClick(self, event):
+        filename = filedialog.asksaveasfilename(initialfile='em-structure.gkmproj', defaultextension=".gkmproj",filetypes = (("Project","*.gkmproj"),("All Files","*.*")))
+        
+        if os.access(os.path.dirname(filename), os.W_OK):
+            ProjectFile.save(filename, self.gerberLayers)
+            
+    def openProject(self, filename):
+        '''
+        Replace the layers by the layers of a project file.
+        '''
+        self.gerberLayers = ProjectFile.load(filename)
+        self.activeLayer = self.gerberLayers[0] if len(self.gerberLayers) > 0 else None
+        self.generateLayers()
+        
+        stale = ProjectFile.staleLayers(self.gerberLayers)
+        
+        if len(stale) > 0:
+            self.loadText.set_text('Source file changed: %s (use Reload)' % (', '.join(os.path.basename(l.filename) for l in stale),))
+        else:
+            self.loadText.set_text('')
+        
+        if self.activeLayer != None:
+            self.setViewport(*self.boundingBox())
+            
+        self.fig.canvas.draw_idle()
+    
+    def _breloadClick(self, event):
+        if (self.loadThread != None) or (self.activeLayer == None) or (self.activeLayer.filename == None):
+            return
+        
+        if os.path.exists(self.activeLayer.filename):
+            self.loadFile(self.activeLayer.filename, self.activeLayer)
+            
+    def _bcancelClick(self, event):
+        self.loadCancel.set()
+        self.loadText.set_text('Canceling...')
             
-            if len(self.gerberLayers) > 0:
-                self.activeLayer = self.gerberLayers[0]
+    def loadFile(self, fname, layer = None):
+        '''
+        Load a layer file in a background thread. The layer is added by the UI thread when finished.
+        If a layer is given it is reloaded, keeping the pads of unchanged nets.
+        '''
+        self.loadCancel.clear()
+        self.loadProgress = (0, 0)
+        self.loadText.set_text('Loading %s...' % (os.path.basename(fname),))
+        self.bcancelAx.set_visible(True)
+        
+        self.loadThread = threading.Thread(target=self._loadWorker, args=(fname, layer), daemon=True)
+        self.loadThread.start()
+        self.loadTimer.start()
+        
+    def _loadWorker(self, fname, layer):
+        '''
+        Background thread. Must not touch matplotlib objects.
+        '''
+        try:
+            if layer == None:
+                layer = GerberLayer(filename = fname, progress = self._loadProgressCallback, 
+                                    min_width = self.minWidth, min_clearance = self.minClearance)
+                
+                if self.loadCancel.is_set():
+                    # canceled after the last entity was read
+                    raise LoadCancelled()
+            else:
+                # the layer state is swapped at the end of the reload
+                layer.reload(fname, progress = self._loadProgressCallback)
+                
+            self.loadResult.put((layer, None))
+        except LoadCancelled:
+            self.loadResult.put((None, None))
+        except Exception as e:
+            self.loadResult.put((None, e))
+    
+    def _loadProgressCallback(self, done, total):
+        self.loadProgress = (done, total)
+        
+        if self.loadCancel.is_set():
+            raise LoadCancelled()
+        
+    def _loadPoll(self):
+        '''
+        Timer callback in the UI thread. Show the progress and take over the finished layer.
+        '''
+        try:
+            layer, error = self.loadResult.get_nowait()
+        except queue.Empty:
+            done, total = self.loadProgress
+            
+            if self.loadCancel.is_set():
+                pass
+            elif (total > 0) and (done < total):
+                self.loadText.set_text('Loading... %d / %d entities' % (done, total))
+            elif total > 0:
+                # the union and cleanup of the nets can not be interrupted
+                self.bcancelAx.set_visible(False)
+                self.loadText.set_text('Merging nets...')
+                
+            self.fig.canvas.draw_idle()
+            return
+        
+        self.loadTimer.stop()
+        self.loadThread = None
+        self.bcancelAx.set_visible(False)
+        
+        if error != None:
+            self.loadText.set_text('Loading failed: %s' % (str(error),))
+        elif layer == None:
+            self.loadText.set_text('Loading canceled.')
+        else:
+            self.loadText.set_text(self._violationText(layer))
+            
+            if layer in self.gerberLayers:
+                # reloaded, keep the viewport
+                self.generateLayers()
+            else:
+                self.gerberLayers.append(layer)
+                self.generateLayers()
+            
+                if len(self.gerberLayers) > 0:
+                    self.activeLayer = self.gerberLayers[0]
+                    
+                self.setViewport(*self.boundingBox())
+            
+        self.fig.canvas.draw_idle()
+    
+    def _violationText(self, layer):
+        if layer.violations == None:
+            return ''
+        
+        (widths, gaps) = layer.violations
+        
+        if len(widths) + len(gaps) == 0:
+            return ''
+        
+        return '%d features narrower than %s mm, %d gaps smaller than %s mm (red)' % (len(widths), layer.min_width, len(gaps), layer.min_clearance)
     
     def _bsaveClick(self, event):
         filename = filedialog.asksaveasfilename(initialfile='em-structure.kicad_mod', defaultextension=".kicad_mod",filetypes = (("KiCad Module","*.kicad_mod"),("All Files","*.*")))
@@ -150,6 +338,10 @@ class PlotWindow(object):
         
         # Mouse Button to select Mode
         if event.button == MouseButton.LEFT:
+            if self.loadThread != None:
+                # a reload replaces the nets, pads are edited when it is finished
+                return
+            
             self.padProtoEdge, self.padProtoNet = self._edgeNetInDist(event.x, event.y)
     
             if self.padProtoEdge == None:
@@ -164,9 +356,9 @@ class PlotWindow(object):
         # remove pad prototype
         if self.padProto != None:
             if self.mouseMode == self.MOUSE_DRAG:
-                self.padProtoNet.addPad(self.padProtoPoly)
+                self.activeLayer.addPad(self.padProtoNet, self.padProtoPoly)
                 patch = self.plotPoly(self.padProtoPoly, self.activeLayer.getColor())
-                self.polyPatches.append(patch)
+                self.padPatches[id(self.padProtoPoly)] = patch
                 
             self.padProto.remove()
             self.padProto = None
@@ -193,6 +385,41 @@ class PlotWindow(object):
         self.ax.set_ylim([event.ydata - (event.ydata - y1) * scale, 
                           event.ydata - (event.ydata - y2) * scale])
     
+    def _keyPress(self, event):
+        if event.key in ('delete', 'backspace'):
+            self.removeHoverPad()
+    
+    def removeHoverPad(self):
+        '''
+        Delete the pad under the cursor.
+        '''
+        if (self.hoverPad == None) or (self.activeLayer == None) or (self.loadThread != None):
+            return
+        
+        self.activeLayer.removePad(self.hoverPad)
+        
+        patch = self.padPatches.pop(id(self.hoverPad), None)
+        
+        if patch != None:
+            patch.remove()
+        
+        if self.highlight != None:
+            self.highlight.remove()
+            self.highlight = None
+            
+        self.hoverPad = None
+    
+    def _padInDist(self, x, y, d = 0):
+        if self.activeLayer == None:
+            return None, None
+        
+        tm = self.ax.transData.inverted()
+        xdata, ydata = tm.transform((x, y))
+        x2, _ = tm.transform((x + d, y))
+        maxdist = x2 - xdata
+        
+        return self.activeLayer.padAt(xdata, ydata, maxdist)
+    
     def _edgeNetInDist(self, x, y, d = 25):
         if self.activeLayer == None:
             return None, None
@@ -236,6 +463,8 @@ class PlotWindow(object):
         if self.highlight != None:
             self.highlight.remove()
             self.highlight = None
+            
+        self.hoverPad = None
                 
         if self.mouseMode == self.MOUSE_PAN:   
             tm = self.ax.transData.inverted()
@@ -278,6 +507,15 @@ class PlotWindow(object):
             if self.activeLayer == None:
                 return
             
+            # pads are picked before edges
+            pad, _ = self._padInDist(event.x, event.y)
+            
+            if pad != None:
+                self.hoverPad = pad
+                self.highlight = PolygonPatch(pad, facecolor='none', edgecolor='#E02020', linewidth=2)
+                self.ax.add_patch(self.highlight)
+                return
+            
             edge, _ = self._edgeNetInDist(event.x, event.y, self.selectDist)
     
             if edge == None:
@@ -300,10 +538,44 @@ class PlotWindow(object):
             for poly in multipoly.geoms:
                 patch = self.plotPoly(poly, layer.getColor())
                 self.polyPatches.append(patch)
+                
+            for net in layer.getNets():
+                for pad in net.getPads():
+                    self.padPatches[id(pad)] = self.plotPoly(pad, layer.getColor())
+                    
+            self.plotViolations(layer)
+            
+    def plotViolations(self, layer):
+        '''
+        Highlight the narrow features and small gaps found by the layer validation.
+        '''
+        if layer.violations == None:
+            return
+        
+        (widths, gaps) = layer.violations
+        
+        for _, poly in widths:
+            patch = PolygonPatch(poly, facecolor='#E02020', edgecolor='#E02020', linewidth=2)
+            self.ax.add_patch(patch)
+            self.violationPatches.append(patch)
+            
+        for _, _, line, _ in gaps:
+            x, y = line.xy
+            self.violationPatches.extend(self.ax.plot(x, y, color='#E02020', linewidth=2, marker='x'))
         
     def clear(self):
         for patch in self.polyPatches:
             patch.remove()
+            
+        for patch in self.padPatches.values():
+            patch.remove()
+            
+        for patch in self.violationPatches:
+            patch.remove()
+            
+        self.polyPatches = []
+        self.padPatches = {}
+        self.violationPatches = []
         
     def setViewport(self, minx, miny, maxx, maxy):
         self.ax.set_xlim([minx, maxx])
@@ -313,40 +585,15 @@ class PlotWindow(object):
         return self.activeLayer.boundingBox()    
     
     def exportKiCadModule(self, filename, footprint_name = 'EM-Structure', description="EM Structure imported from Gerber file format.", tags="em structure gerber" ):
-        mod = kmt.Footprint(footprint_name)
-        mod.setDescription(description)
-        mod.setTags(tags)
-        
-        # set general values
-        mod.append(kmt.Text(type='reference', text='REF**', at=[0, -3], layer='F.SilkS'))
-        mod.append(kmt.Text(type='value', text=footprint_name, at=[1.5, 3], layer='F.Fab'))
-        
-        # create silscreen
-        #mod.append(kmt.RectLine(start=[-2, -2], end=[5, 2], layer='F.SilkS'))
-        
-        (minx, miny, maxx, maxy) = self.boundingBox()
-        w = maxx - minx
-        h = maxy - miny
-        ox = - maxx + w/2
-        oy = - maxy + h/2
-        
-        # create courtyard
-        mod.append(kmt.RectLine(start=[-w/2, -h/2], end=[w/2, h/2], layer='F.CrtYd'))
-        #mod.append(kmt.FilledRect(start=[-w/2, -h/2], end=[w/2, h/2], layer='F.Mask'))
-        
-        n = 1
-        
-        # iterate layers
-        for layer in self.gerberLayers:
-            n = layer.appendKicadLayer(mod, mod_layer=layer.getID(), offset_x = ox, offset_y = oy, startpad=n)
-        
-        # output kicad model
-        file_handler = kmt.KicadFileHandler(mod)
-        file_handler.writeFile(filename)
+        ModuleExport.exportKiCadModule(self.gerberLayers, filename, footprint_name, description, tags, bbox=self.boundingBox())
         
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Place pads on gerber/dxf structures and export KiCad footprints.')
+    parser.add_argument('--min-width', type=float, help='Highlight copper features narrower than this (mm)')
+    parser.add_argument('--min-clearance', type=float, help='Highlight gaps between nets smaller than this (mm)')
+    args = parser.parse_args()
 
     tk.Tk().withdraw()
-    t = PlotWindow()
+    t = PlotWindow(args.min_width, args.min_clearance)
     plt.show(block=True)
     
\ No newline at end of file
@@ -0,0 +1,170 @@
+'''
+Binary project file storing the cleaned up layers and pads of a session.
+
+Layout (little endian):
+    8 bytes     magic
+    uint32      format version
+    uint32      header length
+    header      JSON, padded to 8 bytes
+    data        raw buffers referenced by the header as (offset, length) relative to the data start
+
+Per layer the data contains the WKB of every net, the WKB offsets, the closed pad rings as
+float64 coordinates, the ring offsets and the net index of every pad. Loading memory maps the
+file and creates the geometries from the mapped buffers, the source files are not parsed.
+'''
+
+import os
+import json
+import mmap
+import struct
+
+import numpy as np
+import shapely
+
+from GerberLayer import GerberLayer
+from GerberNet import GerberNet
+from LayoutFile import file_hash
+
+MAGIC = b'GKMPROJ\0'
+VERSION = 1
+ALIGN = 8
+
+def _pad(n):
+    return (-n) % ALIGN
+
+class _Writer(object):
+    '''
+    Collects the data buffers and their position.
+    '''
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def add(self, data):
+        data = bytes(data)
+        ref = [self.size, len(data)]
+
+        self.chunks.append(data)
+        self.chunks.append(b'\0' * _pad(len(data)))
+        self.size += len(data) + _pad(len(data))
+
+        return ref
+
+def save(filename, layers):
+    '''
+    Save the layers including pads to a project file.
+    '''
+    w = _Writer()
+    header = {'layers': []}
+
+    for layer in layers:
+        nets = layer.getNets()
+        wkb = [shapely.to_wkb(net.getPolygon()) for net in nets]
+        wkbOffsets = np.cumsum([0] + [len(b) for b in wkb], dtype=np.int64)
+
+        pads = [(i, pad) for i, net in enumerate(nets) for pad in net.getPads()]
+        padCoords = [np.asarray(pad.exterior.coords, dtype=np.float64) for _, pad in pads]
+        padOffsets = np.cumsum([0] + [len(c) for c in padCoords], dtype=np.int64)
+        padNets = np.array([i for i, _ in pads], dtype=np.int64)
+
+        header['layers'].append({
+            'id': layer.getID(),
+            'name': layer.name,
+            'color': layer.getColor(),
+            'tolerance': layer.tolerance,
+            'arc_segments': layer.arc_segments,
+            'grid_size': layer.grid_size,
+            'grid': layer.grid,
+            'filename': layer.filename,
+            'source_hash': layer.sourceHash,
+            'nets': len(nets),
+            'pads': len(pads),
+            'net_wkb': w.add(b''.join(wkb)),
+            'net_offsets': w.add(wkbOffsets.tobytes()),
+            'pad_coords': w.add(np.concatenate(padCoords).tobytes() if padCoords else b''),
+            'pad_offsets': w.add(padOffsets.tobytes()),
+            'pad_nets': w.add(padNets.tobytes()),
+        })
+
+    hdr = json.dumps(header).encode('utf-8')
+    hdr += b' ' * _pad(len(hdr))
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<II', VERSION, len(hdr)))
+        f.write(hdr)
+
+        for c in w.chunks:
+            f.write(c)
+
+def load(filename):
+    '''
+    Load the layers of a project file. The net geometry is used as stored, no cleanup is performed.
+    Return the list of GerberLayers.
+    '''
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        if mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a project file: %s' % (str(filename),))
+
+        version, hlen = struct.unpack_from('<II', mm, len(MAGIC))
+
+        if version != VERSION:
+            raise ValueError('Unsupported project file version %d' % (version,))
+
+        start = len(MAGIC) + 8
+        header = json.loads(mm[start:start + hlen].decode('utf-8'))
+        base = start + hlen
+
+        return [_loadLayer(mm, base, l) for l in header['layers']]
+    finally:
+        mm.close()
+
+def _array(mm, base, ref, dtype):
+    offset, length = ref
+    return np.frombuffer(mm, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=base + offset)
+
+def _loadLayer(mm, base, l):
+    layer = GerberLayer(l['id'], l['arc_segments'], l['tolerance'], l['color'], grid_size=l.get('grid_size'))
+    layer.grid = l.get('grid')
+    layer.name = l['name']
+    layer.filename = l['filename']
+    layer.sourceHash = l['source_hash']
+
+    # nets
+    wkbStart = base + l['net_wkb'][0]
+    offsets = _array(mm, base, l['net_offsets'], np.int64)
+    wkb = [mm[wkbStart + offsets[i]:wkbStart + offsets[i + 1]] for i in range(l['nets'])]
+    nets = [GerberNet(poly) for poly in shapely.from_wkb(wkb)] if wkb else []
+
+    # pads
+    if l['pads'] > 0:
+        coords = _array(mm, base, l['pad_coords'], np.float64).reshape(-1, 2)
+        ringOffsets = _array(mm, base, l['pad_offsets'], np.int64)
+        padNets = _array(mm, base, l['pad_nets'], np.int64)
+        pads = shapely.from_ragged_array(shapely.GeometryType.POLYGON, coords, (ringOffsets, np.arange(l['pads'] + 1)))
+
+        for i, pad in zip(padNets, pads):
+            layer.padIndex.add(pad, nets[i])
+            nets[i].addPad(pad)
+
+    layer.nets = nets
+
+    return layer
+
+def staleLayers(layers):
+    '''
+    Return the layers whose source file changed since the layer was imported.
+    '''
+    stale = []
+
+    for layer in layers:
+        if (layer.filename == None) or (layer.sourceHash == None):
+            continue
+
+        if (not os.path.exists(layer.filename)) or (file_hash(layer.filename) != layer.sourceHash):
+            stale.append(layer)
+
+    return stale
@@ -0,0 +1,126 @@
+'''
+Synthetic region-only Gerber and DXF layouts for the benchmarks.
+'''
+
+import random
+import argparse
+from math import sin, cos, pi
+
+import shapely.geometry as geo
+import shapely.ops as sop
+
+def generateStructure(regions = 100, vertices = 16, holes = 0, overlap = 0.0, radius = 1.0, seed = 0):
+    '''
+    Generate a synthetic EM structure as a list of hole free polygons.
+
+    @param regions: Number of structures.
+    @param vertices: Number of vertices of each structure outline.
+    @param holes: Number of holes per structure. Structures with holes are emitted as touching hole free pieces.
+    @param overlap: Ratio of structures that get an overlapping copy, so the importer has to union them.
+    @param radius: Radius of the structures in mm.
+    @param seed: Random seed for reproducible files.
+    '''
+    rnd = random.Random(seed)
+    polys = []
+
+    # square grid with spacing of three radii
+    cols = max(1, int(round(regions ** 0.5)))
+    pitch = 3 * radius
+
+    for i in range(regions):
+        cx = (i % cols) * pitch
+        cy = (i // cols) * pitch
+
+        outline = _circle(cx, cy, radius, vertices, rnd.uniform(0, 2 * pi / vertices))
+        polys += _splitHoles(outline, cx, cy, radius, holes)
+
+        if rnd.random() < overlap:
+            # overlapping copy, shifted by a third of the radius
+            polys.append(_circle(cx + radius / 3, cy + radius / 3, radius, vertices, rnd.uniform(0, 2 * pi / vertices)))
+
+    return polys
+
+def _circle(cx, cy, r, n, phase = 0):
+    return geo.Polygon([(cx + r * cos(phase + 2 * pi * k / n), cy + r * sin(phase + 2 * pi * k / n)) for k in range(n)])
+
+def _splitHoles(outline, cx, cy, r, holes):
+    '''
+    Cut square holes into the outline and split the result into hole free pieces that union to the holed polygon.
+    '''
+    if holes <= 0:
+        return [outline]
+
+    # holes in a row along the x axis
+    a = r / (2 * holes + 1) / 2
+    centers = [cx - r / 2 + r * (k + 0.5) / holes for k in range(holes)]
+
+    for hx in centers:
+        outline = outline.difference(geo.box(hx - a, cy - a, hx + a, cy + a))
+
+    pieces = [outline]
+
+    # a vertical cut through every hole center removes the holes
+    for hx in centers:
+        cut = geo.LineString([(hx, cy - 2 * r), (hx, cy + 2 * r)])
+        pieces = [g for p in pieces for g in sop.split(p, cut).geoms]
+
+    return pieces
+
+def writeGerber(filename, polys):
+    '''
+    Write the polygons as G36/G37 regions of a RS-274X file with 3.6 mm coordinates.
+    '''
+    with open(filename, 'w') as f:
+        f.write('G04 Synthetic EM structure *\n')
+        f.write('%FSLAX36Y36*%\n')
+        f.write('%MOMM*%\n')
+        f.write('%ADD10C,.010*%\n')
+        f.write('D10*\n')
+
+        for p in polys:
+            coords = list(p.exterior.coords)
+
+            f.write('G36*\n')
+            f.write('X%dY%dD02*\n' % _gbrCoord(*coords[0]))
+
+            for xy in coords[1:]:
+                f.write('X%dY%dD01*\n' % _gbrCoord(*xy))
+
+            f.write('G37*\n')
+
+        f.write('M02*\n')
+
+def _gbrCoord(x, y):
+    return (int(round(x * 1e6)), int(round(y * 1e6)))
+
+def writeDxf(filename, polys, layer = 'F.Cu'):
+    '''
+    Write the polygons as closed POLYLINE entities of a DXF file in mm.
+    '''
+    import ezdxf
+
+    doc = ezdxf.new('R2000')
+    doc.units = ezdxf.units.MM
+    msp = doc.modelspace()
+
+    for p in polys:
+        msp.add_polyline2d(list(p.exterior.coords)[:-1], close=True, dxfattribs={'layer': layer})
+
+    doc.saveas(filename)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic region-only Gerber or POLYLINE DXF files.')
+    parser.add_argument('filename', help='Output file, *.gbr or *.dxf')
+    parser.add_argument('--regions', type=int, default=100)
+    parser.add_argument('--vertices', type=int, default=16)
+    parser.add_argument('--holes', type=int, default=0)
+    parser.add_argument('--overlap', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    polys = generateStructure(args.regions, args.vertices, args.holes, args.overlap, seed=args.seed)
+
+    if args.filename.endswith('.dxf'):
+        writeDxf(args.filename, polys)
+    else:
+        writeGerber(args.filename, polys)
@@ -7,9 +7,12 @@ Created on Feb 3, 2021
 import gerber
 import tkinter as tk
 from tkinter import filedialog
+import numpy as np
+import shapely
 import shapely.ops as sop
 import shapely.geometry as geo
 import shapely.affinity as aff
+from shapely.strtree import STRtree
 import KicadModTree as kmt
 from math import sqrt, atan2, pi
 import os
@@ -21,17 +24,18 @@ class GerberObject:
         
         union = sop.unary_union(self.shapelyPrimitives)
         
-        self.closedPolygons = [geo.polygon.orient(poly) for poly in union]
-        self.polygonLines = []
+        self.closedPolygons = [geo.polygon.orient(poly) for poly in getattr(union, 'geoms', [union])]
         self.pads = []
+        self.preparedPolygons = False
         
         self.tolerance = 1e-6
         
-        for poly in self.closedPolygons:
-            boundary = poly.boundary
-            
-            for i in range(len(boundary.coords) - 1):
-                self.polygonLines.append(geo.LineString([boundary.coords[i], boundary.coords[i + 1]]))
+        # boundary segments of all rings as (n, 2, 2) array, the line strings and their index are built on first use
+        coords, ring = shapely.get_coordinates(shapely.get_rings(self.closedPolygons), return_index=True)
+        inner = ring[:-1] == ring[1:]
+        self.segments = np.stack((coords[:-1][inner], coords[1:][inner]), axis=1)
+        self.polygonLines = None
+        self.lineTree = None
         
     def boundingBox(self):
         mp = geo.MultiPolygon(self.closedPolygons + self.pads)
@@ -42,10 +46,51 @@ class GerberObject:
         return self.closedPolygons
     
     def polyLines(self):
+        if self.polygonLines is None:
+            self.polygonLines = shapely.linestrings(self.segments)
+            
         return self.polygonLines
     
+    def linesInDist(self, x, y, dist):
+        '''
+        Return the boundary segments within a distance of the point (x, y).
+        '''
+        if self.lineTree == None:
+            self.lineTree = STRtree(self.polyLines())
+            
+        idx = self.lineTree.query(geo.Point(x, y), predicate='dwithin', distance=dist)
+        
+        return list(self.polyLines()[np.sort(idx)])
+    
     def addPad(self, p):
         self.pads.append(p)
+        
+    def _getPreparedPolygons(self):
+        '''
+        Return the closed polygons prepared for the repeated pad predicates. Prepared on first use.
+        '''
+        if not self.preparedPolygons:
+            shapely.prepare(self.closedPolygons)
+            self.preparedPolygons = True
+            
+        return self.closedPolygons
+        
+    def _polygonPads(self):
+        '''
+        Return the list of pads touching each closed polygon (within the tolerance), in the order the pads were added.
+        '''
+        polyPads = [[] for _ in self.closedPolygons]
+        
+        if len(self.pads) == 0:
+            return polyPads
+        
+        # the query uses the prepared polygons instead of preparing them for every export
+        poly, pad = STRtree(self.pads).query(self._getPreparedPolygons(), predicate='dwithin', distance=self.tolerance)
+        
+        for i in np.lexsort((pad, poly)):
+            polyPads[poly[i]].append(self.pads[pad[i]])
+            
+        return polyPads
             
     def getPads(self):
         return self.pads
@@ -101,14 +146,7 @@ class GerberObject:
         n = 1
         
         # iterate closed polygons
-        for poly in self.closedPolygons:
-            # find pads
-            pads = []
-            
-            for p in self.pads:
-                if(p.distance(poly) < self.tolerance):
-                    pads.append(p)
-                    
+        for poly, pads in zip(self.closedPolygons, self._polygonPads()):
             if len(pads) == 0:
                 # poly primitive        
                 map = geo.mapping(poly)
@@ -189,6 +227,7 @@ class GerberView(tk.Frame):
         ''' Drawing canvas '''
         self.dwgGerber = tk.Canvas(root)
         self.dwgGerber.bind("<Button-1>", self.dwgGerberClick)
+        self.dwgGerber.bind("<Configure>", self.dwgGerberResize)
         self.dwgGerber.pack(pady=self.btnLoad.winfo_height(), fill=tk.BOTH, expand=tk.YES)
         
         ''' Filename '''
@@ -197,6 +236,16 @@ class GerberView(tk.Frame):
         ''' Gerber Object '''
         self.gbr = None
         
+        ''' Canvas items of the regions, pads and the selected line '''
+        self.regionItems = []
+        self.padItems = []
+        self.lineItem = None
+        
+        ''' View transformation, set by drawGerber '''
+        self.view_margin = 5
+        self.view_height = None
+        self.scale_x = None
+        
     ''' Load button click. Select the file name '''
     def btnLoadClick(self):
         self.filename = filedialog.askopenfilename()
@@ -213,11 +262,7 @@ class GerberView(tk.Frame):
         
     ''' Load button click. Select the file name '''
     def dwgGerberClick(self, event):
-        clklines = []
-        
-        for l in self.gbr.polyLines():
-            if l.distance(geo.Point(*self.getGerberCoord(event.x, event.y))) < self.getGerberDist(5):
-                clklines.append(l)
+        clklines = self.gbr.linesInDist(*self.getGerberCoord(event.x, event.y), self.getGerberDist(5))
                 
         if len(clklines) > 1:
             print('Ambiguous selection!')
@@ -235,8 +280,38 @@ class GerberView(tk.Frame):
                 
             poly = geo.Polygon([(x2,y2), (x1,y1), (x1+(y2-y1),y1-(x2-x1)), (x2+(y2-y1),y2-(x2-x1))])
             self.gbr.addPad(poly)
-            self.drawGerber()
-            self.drawLine(line)
+            
+            # only the new pad and the selected line are drawn
+            if self.lineItem != None:
+                self.dwgGerber.delete(self.lineItem)
+                
+            self.padItems.append(self.drawRegion(poly))
+            self.lineItem = self.drawLine(line)
+            
+    def dwgGerberResize(self, event):
+        '''
+        Fit the drawn items to the new canvas size with a canvas transformation.
+        '''
+        if self.scale_x == None:
+            return
+        
+        (minx, miny, maxx, maxy) = self.gbr.boundingBox()
+        view_height = event.height - 2 * self.view_margin
+        view_width = event.width - 2 * self.view_margin
+        scale = min(view_width / (maxx - minx), view_height / (maxy - miny))
+        
+        if scale <= 0:
+            return
+        
+        # scale around the lower left corner of the view and move it to the new lower edge
+        f = scale / self.scale_x
+        self.dwgGerber.scale('all', self.view_margin, self.view_height + self.view_margin, f, f)
+        self.dwgGerber.move('all', 0, view_height - self.view_height)
+        
+        self.view_height = view_height
+        self.view_width = view_width
+        self.scale_x = scale
+        self.scale_y = scale
         
     def readGerber(self):
         if(self.filename == None):
@@ -256,7 +331,6 @@ class GerberView(tk.Frame):
         (minx, miny, maxx, maxy) = self.gbr.boundingBox()
         
         # transformations
-        self.view_margin = 5
         self.view_height = self.dwgGerber.winfo_height() - 2 * self.view_margin
         self.view_width = self.dwgGerber.winfo_width() - 2 * self.view_margin
         self.translate_x = -minx
@@ -264,17 +338,26 @@ class GerberView(tk.Frame):
         self.scale_x = min(self.view_width / (maxx - minx), self.view_height / (maxy - miny))
         self.scale_y = self.scale_x
         
-        for r in self.gbr.closedRegions():
-            self.drawRegion(r)
-            
-        for p in self.gbr.getPads():
-            self.drawRegion(p)
+        self.regionItems = [self.drawRegion(r) for r in self.gbr.closedRegions()]
+        self.padItems = [self.drawRegion(p) for p in self.gbr.getPads()]
+        self.lineItem = None
         
     def getViewCoord(self, x, y):
         sx = (x + self.translate_x) * self.scale_x + self.view_margin
         sy = self.view_height - (y + self.translate_y) * self.scale_y + self.view_margin
         
         return (sx, sy)
+    
+    def getViewCoords(self, coords):
+        '''
+        Transform a coordinate sequence to the flat canvas coordinate list [sx0, sy0, sx1, sy1, ...].
+        '''
+        xy = np.asarray(coords)[:, :2]
+        sxy = np.empty_like(xy)
+        sxy[:, 0] = (xy[:, 0] + self.translate_x) * self.scale_x + self.view_margin
+        sxy[:, 1] = self.view_height - (xy[:, 1] + self.translate_y) * self.scale_y + self.view_margin
+        
+        return sxy.ravel().tolist()
         
     def getGerberCoord(self, sx, sy):
         x = (sx - self.view_margin) / self.scale_x - self.translate_x
@@ -286,22 +369,10 @@ class GerberView(tk.Frame):
         return d / self.scale_x
     
     def drawLine(self, l):
-        map = geo.mapping(l)
-        coords = ()
-        
-        for xy in map['coordinates']:
-            coords = coords + self.getViewCoord(*xy)
-        
-        self.dwgGerber.create_line(*coords, width = 2, fill = '#FF0000')
+        return self.dwgGerber.create_line(self.getViewCoords(l.coords), width = 2, fill = '#FF0000')
         
     def drawRegion(self, r):
-        map = geo.mapping(r)
-        coords = ()
-        
-        for xy in map['coordinates'][0]:
-            coords = coords + self.getViewCoord(*xy)
-        
-        self.dwgGerber.create_polygon(coords, outline='#000000', fill='#FFF0E0')
+        return self.dwgGerber.create_polygon(self.getViewCoords(r.exterior.coords), outline='#000000', fill='#FFF0E0')
 
 if __name__ == '__main__':
     
@@ -0,0 +1,8 @@
+'''
+The modules are imported from the script directory like the scripts themselves do.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,78 @@
+'''
+Net groups and pad numbers of layers connected through vias.
+'''
+
+import shapely
+
+from Connectivity import Connectivity
+from GerberLayer import GerberLayer
+from GerberNet import GerberNet
+import SyntheticLayout
+
+TOP = [shapely.box(0, 0, 1, 1), shapely.box(3, 0, 4, 1), shapely.box(6, 0, 7, 1)]
+BOTTOM = [shapely.box(0, 0, 4, 1), shapely.box(6, 0, 7, 1)]
+# connects the first two top nets through the first bottom net, the last via has no copper
+VIAS = [shapely.Point(0.5, 0.5).buffer(0.2), shapely.Point(3.5, 0.5).buffer(0.2), shapely.Point(9, 9).buffer(0.2)]
+
+def _layer(polys, id):
+    layer = GerberLayer(id)
+    layer.nets = [GerberNet(p) for p in polys]
+
+    return layer
+
+def _addPad(layer, i):
+    net = layer.getNets()[i]
+    (xmin, ymin, xmax, ymax) = net.getPolygon().bounds
+    edge, _ = net.closestEdge((xmin + xmax) / 2, ymin)
+    layer.addPad(net, net.generateRectPad(edge, width=0.2, height=0.2))
+
+def test_netGroups():
+    top = _layer(TOP, 'F.Cu')
+    bottom = _layer(BOTTOM, 'B.Cu')
+    conn = Connectivity([top, bottom], VIAS)
+
+    assert conn.netGroups(top).tolist() == [0, 0, 1]
+    assert conn.netGroups(bottom).tolist() == [0, 2]
+    assert conn.viaGroups().tolist() == [0, 0, 3]
+    assert conn.connectedNets(top, top.getNets()[1]) == [(top, top.getNets()[0]), (top, top.getNets()[1]), (bottom, bottom.getNets()[0])]
+
+def test_blindVias():
+    top = _layer(TOP, 'F.Cu')
+    bottom = _layer(BOTTOM, 'B.Cu')
+    conn = Connectivity([top, bottom], VIAS, [['F.Cu', 'B.Cu'], ['F.Cu'], ['F.Cu', 'B.Cu']])
+
+    assert conn.netGroups(top).tolist() == [0, 1, 2]
+    assert conn.netGroups(bottom).tolist() == [0, 3]
+
+def test_padNumbers():
+    top = _layer(TOP, 'F.Cu')
+    bottom = _layer(BOTTOM, 'B.Cu')
+
+    for i in (1, 2):
+        _addPad(top, i)
+
+    for i in (0, 1):
+        _addPad(bottom, i)
+
+    conn = Connectivity([top, bottom], VIAS)
+
+    assert conn.padNumbers() == {top: [None, 1, 2], bottom: [1, 3]}
+    # variant pads replace the placed pads of a layer
+    assert conn.padNumbers({top: {}}, startpad=5) == {top: [None, None, None], bottom: [5, 6]}
+
+def test_reloadRebuildsGroups(tmp_path):
+    filename = str(tmp_path / 'bottom.dxf')
+    SyntheticLayout.writeDxf(filename, BOTTOM)
+    top = _layer(TOP, 'F.Cu')
+    bottom = GerberLayer(filename=filename)
+    conn = Connectivity([top, bottom], VIAS)
+
+    assert conn.netGroups(top).tolist() == [0, 0, 1]
+
+    # the bottom net is split, a net is added
+    SyntheticLayout.writeDxf(filename, [shapely.box(0, 0, 1, 1), shapely.box(3, 0, 4, 1), shapely.box(6, 0, 7, 1), shapely.box(8.5, 8.5, 9.5, 9.5)])
+    bottom.reload()
+
+    assert len(conn.netGroups(bottom)) == 4
+    assert conn.netGroups(top).tolist() == [0, 1, 2]
+    assert sorted(conn.viaGroups().tolist()) == sorted(set(conn.viaGroups().tolist()))
@@ -0,0 +1,114 @@
+'''
+Layer cache and job handling of the conversion worker.
+'''
+
+import io
+import os
+import json
+
+import pytest
+import shapely
+
+from ConversionWorker import ConversionWorker, _LRUCache
+import SyntheticLayout
+
+POLYS = [shapely.box(0, 0, 1, 5), shapely.box(3, 0, 4, 1)]
+
+@pytest.fixture
+def worker():
+    worker = ConversionWorker(workers=4)
+    yield worker
+    worker.shutdown()
+
+def _job(tmp_path, source, id = 1, output = None):
+    return {'id': id, 'output': str(tmp_path / (output or 'out%d.kicad_mod' % (id,))),
+            'layers': [{'filename': source}], 'pads': [{'x': 0.5, 'y': 0, 'width': 0.5}]}
+
+def _source(tmp_path, name = 'layer.dxf', polys = POLYS):
+    filename = str(tmp_path / name)
+    SyntheticLayout.writeDxf(filename, polys)
+
+    return filename
+
+def test_layerCache(tmp_path, worker):
+    source = _source(tmp_path)
+
+    first = worker.convert(_job(tmp_path, source, 1))
+    second = worker.convert(_job(tmp_path, source, 2))
+
+    assert first['ok'] and second['ok']
+    assert first['cache'] == ['miss']
+    assert second['cache'] == ['hit']
+    assert os.path.exists(second['output'])
+
+    with open(first['output']) as f1, open(second['output']) as f2:
+        assert f1.read() == f2.read()
+
+def test_changedFileIsReloaded(tmp_path, worker):
+    source = _source(tmp_path)
+    layer, _ = worker.getLayer(source)
+
+    SyntheticLayout.writeDxf(source, POLYS + [shapely.box(6, 0, 7, 1)])
+    st = os.stat(source)
+    os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    changed, hit = worker.getLayer(source)
+
+    assert not hit
+    assert len(changed.getNets()) == len(layer.getNets()) + 1
+
+def test_layerIds(tmp_path, worker):
+    source = _source(tmp_path)
+    front, _ = worker.getLayer(source, 'F.Cu')
+    back, hit = worker.getLayer(source, 'B.Cu')
+
+    assert not hit
+    assert (front.getID(), back.getID()) == ('F.Cu', 'B.Cu')
+    assert front.filename == source
+    # one parsed file for both layers
+    assert len(worker.layouts) == 1
+
+def test_serveLines(tmp_path, worker):
+    source = _source(tmp_path)
+    jobs = [json.dumps(_job(tmp_path, source, i)) for i in range(8)]
+    jobs += ['{"id": 8, "output": ', '[1, 2]', json.dumps({'id': 9, 'output': 'x.kicad_mod', 'layers': [{'filename': str(tmp_path / 'missing.dxf')}]})]
+    out = io.StringIO()
+
+    worker.serveLines(io.StringIO('\n'.join(jobs) + '\n\n'), out)
+
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    ok = {r['id']: r for r in results if r['ok']}
+    failed = [r for r in results if not r['ok']]
+
+    assert sorted(ok) == list(range(8))
+    # concurrent jobs wait for the one loading the layer
+    assert sorted(r['cache'][0] for r in ok.values()) == ['hit'] * 7 + ['miss']
+    assert len(failed) == 3
+    assert sum(r['error'].startswith('Invalid job') for r in failed) == 2
+    assert [r['id'] for r in failed if not r['error'].startswith('Invalid job')] == [9]
+
+def test_lruEviction():
+    cache = _LRUCache(2)
+    created = []
+
+    def create(key):
+        created.append(key)
+        return key
+
+    for key in ('a', 'b', 'a', 'c', 'b'):
+        cache.get(key, lambda: create(key))
+
+    # b was evicted by c as least recently used entry
+    assert created == ['a', 'b', 'c', 'b']
+    assert len(cache) == 2
+
+def test_failedCreationIsNotCached():
+    cache = _LRUCache(2)
+
+    def fail():
+        raise OSError('unreadable')
+
+    with pytest.raises(OSError):
+        cache.get('a', fail)
+
+    assert cache.get('a', lambda: 1) == (1, False)
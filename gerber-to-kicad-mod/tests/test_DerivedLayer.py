@@ -0,0 +1,145 @@
+'''
+Incremental updates of derived layers compared with a full rebuild.
+'''
+
+import gc
+import pickle
+
+import pytest
+import shapely
+
+import DerivedLayer
+from DerivedLayer import maskLayer, pasteLayer
+from GerberLayer import GerberLayer
+from GerberNet import GerberNet
+import SyntheticLayout
+
+# two traces 0.2 mm apart, a pad on the gap side of each trace bridges them in the mask layer
+POLYS = [shapely.box(0, 0, 1, 5), shapely.box(1.2, 0, 2.2, 5), shapely.box(4, 0, 5, 1)]
+
+def _layer(polys = POLYS, id = 'F.Cu'):
+    layer = GerberLayer(id)
+    layer.nets = [GerberNet(p) for p in polys]
+
+    return layer
+
+def _addPad(layer, x, y, shift = 1, width = 0.5, height = 0.5):
+    net, _ = layer.closestNet(x, y)
+    edge, _ = net.closestEdge(x, y)
+    pad = net.generateRectPad(edge, shift=shift, width=width, height=height)
+    layer.addPad(net, pad)
+
+    return pad
+
+def _assertRebuilt(derived, margin = 0.05, join_style = 'round', copper = True):
+    # same geometry as a layer derived from scratch
+    fresh = DerivedLayer.DerivedLayer(derived.source, derived.getID(), margin, join_style, copper)
+    a = derived.getGeometryArray()
+    b = fresh.getGeometryArray()
+
+    assert len(a) == len(b)
+    assert shapely.area(shapely.symmetric_difference(shapely.union_all(a), shapely.union_all(b))) < 1e-9
+    assert sorted(shapely.area(a).round(9)) == sorted(shapely.area(b).round(9))
+
+def _noRebuild(monkeypatch, derived):
+    derived.getNets()
+
+    def fail(source):
+        raise AssertionError('full rebuild instead of a pad update')
+
+    monkeypatch.setattr(derived, '_rebuild', fail)
+
+def test_addPads(monkeypatch):
+    layer = _layer()
+    mask = maskLayer(layer)
+    _noRebuild(monkeypatch, mask)
+
+    _addPad(layer, 1.0, 2.5)
+    _assertRebuilt(mask)
+    _addPad(layer, 1.2, 2.5, width=0.6)
+    _assertRebuilt(mask)
+    # outside of the copper, overlapping the previous pads
+    _addPad(layer, 4.5, 0, shift=1)
+    _addPad(layer, 4.5, 0, shift=0)
+    _assertRebuilt(mask)
+
+def test_removePads(monkeypatch):
+    layer = _layer()
+    pads = [_addPad(layer, 1.0, 2.5), _addPad(layer, 1.2, 2.5), _addPad(layer, 4.5, 0)]
+    mask = maskLayer(layer)
+    parts = len(mask.getNets())
+    _noRebuild(monkeypatch, mask)
+
+    # both gap pads bridge the traces, the opening is split when both are removed
+    layer.removePad(pads[0])
+    _assertRebuilt(mask)
+    assert len(mask.getNets()) == parts
+
+    layer.removePad(pads[1])
+    _assertRebuilt(mask)
+    assert len(mask.getNets()) == parts + 1
+
+    layer.removePad(pads[2])
+    _assertRebuilt(mask)
+
+def test_pastePads(monkeypatch):
+    layer = _layer()
+    paste = pasteLayer(layer)
+    _noRebuild(monkeypatch, paste)
+    assert len(paste.getNets()) == 0
+
+    pad = _addPad(layer, 4.5, 0)
+    _addPad(layer, 1.0, 2.5)
+    _assertRebuilt(paste, -0.05, 'mitre', False)
+    assert len(paste.getNets()) == 2
+
+    layer.removePad(pad)
+    _assertRebuilt(paste, -0.05, 'mitre', False)
+
+def test_reload(tmp_path):
+    filename = str(tmp_path / 'layer.dxf')
+    SyntheticLayout.writeDxf(filename, POLYS)
+
+    layer = GerberLayer(filename=filename)
+    _addPad(layer, 1.0, 2.5)
+    _addPad(layer, 4.5, 0)
+    mask = maskLayer(layer)
+    _assertRebuilt(mask)
+
+    # the second trace grows, its pads are moved and the mask follows the new nets
+    SyntheticLayout.writeDxf(filename, [POLYS[0], shapely.box(1.2, 0, 2.2, 6), POLYS[2]])
+    layer.reload()
+    _addPad(layer, 2.2, 5.5)
+    _assertRebuilt(mask)
+    assert shapely.intersects(shapely.union_all(mask.getGeometryArray()), shapely.Point(2.2, 5.9))
+
+def test_cacheDoesNotKeepSource():
+    layer = _layer()
+    mask = maskLayer(layer)
+    assert maskLayer(layer) is mask
+
+    del layer
+    gc.collect()
+
+    assert len(DerivedLayer._cache) == 0
+    assert mask.source == None
+
+def test_outerLayerIds():
+    assert maskLayer(_layer(id='B.Cu')).getID() == 'B.Mask'
+    assert pasteLayer(_layer(id='B.Cu')).getID() == 'B.Paste'
+    assert pasteLayer(_layer(id='F.Cu')).getID() == 'F.Paste'
+
+    with pytest.raises(ValueError):
+        maskLayer(_layer(id='In1.Cu'))
+
+    with pytest.raises(ValueError):
+        pasteLayer(_layer(id='In2.Cu'))
+
+def test_pickle():
+    layer = _layer()
+    _addPad(layer, 1.0, 2.5)
+    mask = maskLayer(layer)
+    copy = pickle.loads(pickle.dumps(mask))
+
+    assert copy.source == None
+    assert len(copy.getNets()) == len(mask.getNets())
@@ -0,0 +1,71 @@
+'''
+Prepared net geometry and the predicates using it.
+'''
+
+import pickle
+
+import numpy as np
+import pytest
+import shapely
+from shapely.strtree import STRtree
+
+from GerberLayer import GerberLayer
+from GerberNet import GerberNet
+
+RING = shapely.box(0, 0, 4, 4).difference(shapely.box(1, 1, 3, 3))
+
+def _layer(polys):
+    layer = GerberLayer()
+    layer.nets = [GerberNet(p) for p in polys]
+
+    return layer
+
+def test_containsPoints():
+    net = GerberNet(RING)
+    x = np.array([0.5, 2, 4, 3.5, 5])
+    y = np.array([0.5, 2, 2, 3.5, 5])
+
+    # inside, hole, boundary, inside, outside
+    assert net.containsPoints(x, y).tolist() == [True, False, True, True, False]
+    assert shapely.is_prepared(net.getPolygon())
+
+def test_setPolygonIsPreparedAgain():
+    net = GerberNet(RING)
+    net.containsPoints(2, 2)
+    net.setPolygon(shapely.box(0, 0, 4, 4))
+
+    assert not shapely.is_prepared(net.getPolygon())
+    assert net.containsPoints(2, 2).tolist() == [True]
+    assert shapely.is_prepared(net.getPolygon())
+
+def test_pickledNetIsPreparedAgain():
+    net = GerberNet(RING)
+    net.getPrepared()
+    copy = pickle.loads(pickle.dumps(net))
+
+    assert not shapely.is_prepared(copy.getPolygon())
+    assert shapely.is_prepared(copy.getPrepared())
+
+@pytest.mark.parametrize('predicate', ['intersects', 'within', 'contains', 'covered_by', 'covers', 'touches', 'overlaps', 'crosses', 'dwithin'])
+def test_queryNets(predicate):
+    polys = [RING, shapely.box(6, 0, 7, 1), shapely.box(0, 6, 1, 7)]
+    layer = _layer(polys)
+    geoms = np.array([
+        shapely.box(0.2, 0.2, 0.4, 0.4),            # inside the ring
+        shapely.box(1.5, 1.5, 2.5, 2.5),            # in the hole
+        shapely.box(3.5, 3.5, 6.5, 6.5),            # overlapping the ring
+        shapely.box(7, 1, 8, 2),                    # corner of the second net
+        shapely.LineString([(-1, 6.5), (2, 6.5)]),  # crossing the third net
+        shapely.box(-1, -1, 8, 8),                  # covering all nets
+    ], dtype=object)
+    distance = 0.5 if predicate == 'dwithin' else None
+
+    expected = STRtree(polys).query(geoms, predicate=predicate, distance=distance)
+    result = layer.queryNets(geoms, predicate, distance)
+
+    assert sorted(zip(*expected)) == sorted(zip(*result))
+
+def test_queryNetsEmptyLayer():
+    geom, net = _layer([]).queryNets([shapely.box(0, 0, 1, 1)])
+
+    assert len(geom) == len(net) == 0
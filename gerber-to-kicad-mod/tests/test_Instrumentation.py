@@ -0,0 +1,49 @@
+'''
+Memory report of the import stages.
+'''
+
+import os
+import tracemalloc
+
+import pytest
+
+import Instrumentation as inst
+from LayoutFile import LayoutFile
+
+DXF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test.dxf')
+
+@pytest.fixture
+def memory():
+    inst._inst.clear()
+    inst.enable(output=False, memory=True)
+    yield inst._inst
+    inst.disable()
+    inst._inst.clear()
+
+def test_releaseReported(memory):
+    LayoutFile().read(DXF)
+
+    assert list(memory.releases) == ['LayoutFile.dxf_document']
+    assert memory.releases['LayoutFile.dxf_document'][0] > 0
+
+def test_noReleaseWithoutMemoryTracing():
+    inst._inst.clear()
+    LayoutFile().read(DXF)
+
+    assert inst._inst.releases == {}
+
+def test_disableKeepsForeignTracing():
+    tracemalloc.start()
+
+    try:
+        inst.enable(output=False, memory=True)
+        inst.disable()
+
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    inst.enable(output=False, memory=True)
+    inst.disable()
+
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,117 @@
+'''
+In-memory geometry ingestion of LayoutFile and GerberLayer, DXF entities.
+'''
+
+import numpy as np
+import pytest
+import shapely
+
+from LayoutFile import LayoutFile
+from GerberLayer import layerFromCoords, layerFromWkb
+
+# two overlapping squares, one of them with a hole, and a separate square
+POLYS = np.array([
+    shapely.Polygon([(0, 0), (2, 0), (2, 2), (0, 2)], [[(0.5, 0.5), (1, 0.5), (1, 1), (0.5, 1)]]),
+    shapely.box(1.5, 1.5, 3, 3),
+    shapely.box(5, 0, 6, 1),
+], dtype=object)
+
+def _expected():
+    return shapely.unary_union(POLYS)
+
+def _assertSame(geom, expected, tolerance = 1e-9):
+    assert shapely.area(shapely.symmetric_difference(geom, expected)) < tolerance
+
+def test_addCoords():
+    _, coords, (ring_offsets, polygon_offsets) = shapely.to_ragged_array(POLYS)
+    lf = LayoutFile()
+    lf.add_coords(coords, ring_offsets, polygon_offsets, 'F.Cu')
+
+    assert lf.get_layer_names() == ['F.Cu']
+    _assertSame(lf.get_layer_poly('F.Cu'), _expected())
+
+def test_addWkb():
+    lf = LayoutFile()
+    lf.add_wkb(shapely.to_wkb(POLYS[:2]), 'F.Cu')
+    # a second call adds to the same layer
+    lf.add_wkb([shapely.to_wkb(POLYS[2])], 'F.Cu')
+
+    _assertSame(lf.get_layer_poly('F.Cu'), _expected())
+
+def test_addWkbBuffer():
+    wkb = [shapely.to_wkb(p) for p in POLYS]
+    offsets = np.cumsum([0] + [len(w) for w in wkb])
+    lf = LayoutFile()
+    lf.add_wkb(bytearray(b''.join(wkb)), 'F.Cu', offsets)
+
+    _assertSame(lf.get_layer_poly('F.Cu'), _expected())
+
+def test_gridSnap():
+    # vertices off the 1 µm grid
+    _, coords, offsets = shapely.to_ragged_array(POLYS)
+    lf = LayoutFile(grid_size=1e-3)
+    lf.add_coords(coords + 2e-4, *offsets, 'F.Cu')
+
+    poly = lf.get_layer_poly('F.Cu')
+    xy = shapely.get_coordinates(poly)
+
+    assert lf.get_layer_grid('F.Cu') == 1e-3
+    assert np.allclose(xy, np.round(xy / 1e-3) * 1e-3)
+    _assertSame(poly, _expected(), 1e-2)
+
+def test_nativeGridWarns():
+    lf = LayoutFile(grid_size='native')
+
+    with pytest.warns(UserWarning):
+        lf.add_wkb(shapely.to_wkb(POLYS), 'F.Cu')
+
+    assert lf.get_layer_grid('F.Cu') == None
+
+def test_invalidInput():
+    lf = LayoutFile()
+
+    with pytest.raises(ValueError):
+        lf.add_wkb([shapely.to_wkb(shapely.Point(0, 0))], 'F.Cu')
+
+    # self intersecting outline is repaired before the union
+    bowtie = shapely.Polygon([(0, 0), (1, 1), (1, 0), (0, 1)])
+    lf.add_wkb([shapely.to_wkb(bowtie)], 'F.Cu')
+
+    assert lf.get_layer_poly('F.Cu').area == pytest.approx(0.5)
+
+def test_layerFromCoords():
+    _, coords, offsets = shapely.to_ragged_array(POLYS)
+    layer = layerFromCoords(coords, *offsets, id='B.Cu')
+
+    assert layer.getID() == 'B.Cu'
+    assert len(layer.getNets()) == 2
+    _assertSame(shapely.union_all(layer.getGeometryArray()), _expected())
+
+def test_layerFromWkb():
+    layer = layerFromWkb(shapely.to_wkb(POLYS), grid_size=1e-3)
+
+    assert layer.grid == 1e-3
+    assert len(layer.getNets()) == 2
+    _assertSame(shapely.union_all(layer.getGeometryArray()), _expected())
+
+@pytest.mark.parametrize('insert', [None, (10, 0)])
+def test_dxfPolylineExtrusion(tmp_path, insert):
+    import ezdxf
+
+    # 2D polyline with a flipped extrusion: OCS x points along -x of the world
+    doc = ezdxf.new(units=ezdxf.units.MM)
+    msp = doc.modelspace()
+    space = msp if insert == None else doc.blocks.new('B')
+    space.add_polyline2d([(1, 0), (2, 0), (2, 1), (1, 1)], close=True, dxfattribs={'layer': 'Cu', 'extrusion': (0, 0, -1)})
+
+    if insert != None:
+        msp.add_blockref('B', insert)
+
+    filename = str(tmp_path / 'extrusion.dxf')
+    doc.saveas(filename)
+
+    lf = LayoutFile()
+    lf.read(filename)
+    (dx, dy) = (0, 0) if insert == None else insert
+
+    _assertSame(lf.get_layer_poly('Cu'), shapely.box(dx - 2, dy, dx - 1, dy + 1))
@@ -0,0 +1,78 @@
+'''
+KiCad footprint export of the layers.
+'''
+
+import shapely
+
+from GerberLayer import GerberLayer
+from GerberNet import GerberNet
+import ModuleExport
+
+POLYS = [shapely.box(0, 0, 1, 5), shapely.box(3, 0, 4, 1), shapely.Polygon([(6, 0), (8, 0), (7, 2)])]
+
+def _layer(polys = POLYS, id = 'F.Cu'):
+    layer = GerberLayer(id)
+    layer.nets = [GerberNet(p) for p in polys]
+
+    return layer
+
+def _pad(net, x, y, width = 0.5, height = 0.5):
+    edge, _ = net.closestEdge(x, y)
+
+    return net.generateRectPad(edge, width=width, height=height)
+
+def _read(filename):
+    with open(filename) as f:
+        return f.read()
+
+def test_anchorNodesOfVariantPadsAreNotCached(tmp_path):
+    layer = _layer()
+    net = layer.getNets()[0]
+    layer.addPad(net, _pad(net, 0.5, 0))
+
+    variants = [{'filename': str(tmp_path / ('v%d.kicad_mod' % (i,))), 'pads': {layer: {net: [_pad(net, 1, 2.5, 0.1 + i / 100)]}}} for i in range(20)]
+    ModuleExport.exportKiCadModuleVariants([layer], variants)
+    ModuleExport.exportKiCadModule([layer], str(tmp_path / 'a.kicad_mod'))
+
+    assert list(layer._anchorNodes) == [(net, net.getPads()[0])]
+
+    # the cached nodes give the same footprint
+    ModuleExport.exportKiCadModule([layer], str(tmp_path / 'b.kicad_mod'))
+    assert _read(tmp_path / 'a.kicad_mod') == _read(tmp_path / 'b.kicad_mod')
+
+def test_removePadDropsAnchorNodes(tmp_path):
+    layer = _layer()
+    net = layer.getNets()[0]
+    pad = _pad(net, 0.5, 0)
+    layer.addPad(net, pad)
+    ModuleExport.exportKiCadModule([layer], str(tmp_path / 'a.kicad_mod'))
+
+    layer.removePad(pad)
+
+    assert layer._anchorNodes == {}
+
+def test_parallelExportMatchesSerial(tmp_path):
+    top = _layer()
+    bottom = _layer([shapely.box(0, 2, 2, 3), shapely.box(5, 3, 6, 4)], 'B.Cu')
+    net = top.getNets()[0]
+    top.addPad(net, _pad(net, 0.5, 0))
+    top.addPad(net, _pad(net, 1, 2.5))
+    net = bottom.getNets()[1]
+    bottom.addPad(net, _pad(net, 5.5, 3))
+
+    def variants(prefix):
+        return [{'filename': str(tmp_path / (prefix + '.kicad_mod'))},
+                {'filename': str(tmp_path / (prefix + '_variant.kicad_mod')), 'pads': {bottom: {}}, 'layer_map': {'B.Cu': 'In1.Cu'}, 'offset': (1, 2)}]
+
+    ModuleExport.exportKiCadModuleVariants([top, bottom], variants('serial'))
+    top._kicadNodes = bottom._kicadNodes = None
+    ModuleExport.exportKiCadModuleVariants([top, bottom], variants('parallel'), workers=2)
+
+    for name in ('', '_variant'):
+        serial = _read(tmp_path / ('serial%s.kicad_mod' % (name,)))
+
+        assert serial.count('(pad ') > 0
+        assert serial == _read(tmp_path / ('parallel%s.kicad_mod' % (name,)))
+
+    # converted in this process, reused by later exports
+    assert top._kicadNodes != None and bottom._kicadNodes != None
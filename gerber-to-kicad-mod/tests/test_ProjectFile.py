@@ -0,0 +1,80 @@
+'''
+Saving and loading of project files.
+'''
+
+import pytest
+import shapely
+
+from GerberLayer import GerberLayer
+import ProjectFile
+import SyntheticLayout
+
+POLYS = [shapely.box(0, 0, 1, 5).difference(shapely.box(0.25, 1, 0.75, 2)), shapely.box(3, 0, 4, 1)]
+
+def _load(tmp_path, polys = POLYS, id = 'F.Cu'):
+    filename = str(tmp_path / (id + '.dxf'))
+    SyntheticLayout.writeDxf(filename, polys)
+
+    return GerberLayer(id, color='#A02020', filename=filename)
+
+def _addPad(layer, x, y):
+    net, _ = layer.closestNet(x, y)
+    edge, _ = net.closestEdge(x, y)
+    pad = net.generateRectPad(edge, width=0.5, height=0.3)
+    layer.addPad(net, pad)
+
+    return pad
+
+def test_roundTrip(tmp_path):
+    top = _load(tmp_path)
+    bottom = _load(tmp_path, [shapely.box(0, 0, 2, 2)], 'B.Cu')
+    pads = [_addPad(top, 0.5, 0), _addPad(top, 0, 4), _addPad(top, 3.5, 1)]
+
+    filename = str(tmp_path / 'session.gkmproj')
+    ProjectFile.save(filename, [top, bottom])
+    loaded = ProjectFile.load(filename)
+
+    assert [layer.getID() for layer in loaded] == ['F.Cu', 'B.Cu']
+
+    for old, new in zip([top, bottom], loaded):
+        assert (new.name, new.filename, new.sourceHash, new.getColor()) == (old.name, old.filename, old.sourceHash, old.getColor())
+        assert len(new.getNets()) == len(old.getNets())
+
+        for a, b in zip(old.getNets(), new.getNets()):
+            assert shapely.equals_exact(a.getPolygon(), b.getPolygon(), 0)
+            assert len(b.getPads()) == len(a.getPads())
+            assert all(shapely.equals_exact(p, q, 0) for p, q in zip(a.getPads(), b.getPads()))
+
+    # the pads are in the pad index of the loaded layer
+    nets = loaded[0].getNets()
+    assert [loaded[0].padIndex.getNet(pad) for net in nets for pad in net.getPads()] == [net for net in nets for pad in net.getPads()]
+    assert sum(len(net.getPads()) for net in nets) == len(pads)
+
+def test_emptyLayer(tmp_path):
+    filename = str(tmp_path / 'session.gkmproj')
+    ProjectFile.save(filename, [GerberLayer('F.Cu')])
+
+    layer, = ProjectFile.load(filename)
+
+    assert layer.getNets() == []
+
+def test_notAProjectFile(tmp_path):
+    filename = str(tmp_path / 'session.gkmproj')
+
+    with open(filename, 'wb') as f:
+        f.write(b'not a project file')
+
+    with pytest.raises(ValueError):
+        ProjectFile.load(filename)
+
+def test_staleLayers(tmp_path):
+    layer = _load(tmp_path)
+    filename = str(tmp_path / 'session.gkmproj')
+    ProjectFile.save(filename, [layer])
+    loaded, = ProjectFile.load(filename)
+
+    assert ProjectFile.staleLayers([loaded]) == []
+
+    SyntheticLayout.writeDxf(layer.filename, [shapely.box(0, 0, 1, 6)])
+
+    assert ProjectFile.staleLayers([loaded]) == [loaded]
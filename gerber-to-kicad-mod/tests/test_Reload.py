@@ -0,0 +1,88 @@
+'''
+Pad migration when a changed layer file is reloaded.
+'''
+
+import pytest
+import shapely
+
+from GerberLayer import GerberLayer
+import SyntheticLayout
+
+def _load(tmp_path, polys):
+    filename = str(tmp_path / 'layer.dxf')
+    SyntheticLayout.writeDxf(filename, polys)
+
+    return GerberLayer(filename=filename)
+
+def _addPad(layer, x, y, shift = 1, width = 0.5, height = 0.5):
+    net, _ = layer.closestNet(x, y)
+    edge, _ = net.closestEdge(x, y)
+    pad = net.generateRectPad(edge, shift=shift, width=width, height=height)
+    layer.addPad(net, pad)
+
+    return pad
+
+def _reload(layer, polys):
+    SyntheticLayout.writeDxf(layer.filename, polys)
+
+    return layer.reload()
+
+def _pads(layer):
+    return [pad for net in layer.getNets() for pad in net.getPads()]
+
+def _center(pad):
+    return tuple(round(v, 9) for v in shapely.centroid(pad).coords[0])
+
+def test_unchangedNetKeepsPads(tmp_path):
+    layer = _load(tmp_path, [shapely.box(0, 0, 1, 5), shapely.box(3, 0, 4, 1)])
+    pad = _addPad(layer, 3.5, 0)
+
+    kept, new, moved, dropped = _reload(layer, [shapely.box(0, 0, 1, 6), shapely.box(3, 0, 4, 1)])
+
+    assert (kept, new, moved, dropped) == (1, 1, 0, 0)
+    assert _pads(layer) == [pad]
+    assert layer.padIndex.getNet(pad).getPolygon().equals(shapely.box(3, 0, 4, 1))
+
+def test_sharedCornerKeepsEdge(tmp_path):
+    # the side edges share the corners of the bottom edge and are at distance 0 as well
+    layer = _load(tmp_path, [shapely.box(0, 0, 1, 5)])
+    pad = _addPad(layer, 0.5, 0)
+
+    assert _reload(layer, [shapely.box(0, 0, 1, 6)]) == (0, 1, 1, 0)
+    assert shapely.equals(_pads(layer)[0], pad)
+
+def test_grownEdge(tmp_path):
+    # the right edge grows, the pad stays on it at the new midpoint
+    layer = _load(tmp_path, [shapely.box(0, 0, 1, 5)])
+    _addPad(layer, 1, 2.5, width=0.4, height=0.2)
+
+    _reload(layer, [shapely.box(0, 0, 1, 6)])
+
+    assert _center(_pads(layer)[0]) == (1.1, 3)
+    assert shapely.area(_pads(layer)[0]) == pytest.approx(0.4 * 0.2)
+
+def test_movedEdge(tmp_path):
+    # the top edge moves by less than the pad size, closer side edges share its old corners
+    layer = _load(tmp_path, [shapely.box(0, 0, 1, 5)])
+    _addPad(layer, 0.5, 5, shift=-1)
+
+    _reload(layer, [shapely.box(0, 0, 1, 5.2)])
+
+    assert _center(_pads(layer)[0]) == (0.5, 4.95)
+
+def test_automaticWidth(tmp_path):
+    # a pad as wide as its edge follows the edge length
+    layer = _load(tmp_path, [shapely.box(0, 0, 1, 5)])
+    _addPad(layer, 0.5, 0, width=0, height=0.3)
+
+    _reload(layer, [shapely.box(0, 0, 2, 5)])
+    (xmin, ymin, xmax, ymax) = shapely.bounds(_pads(layer)[0])
+
+    assert (round(xmin, 9), round(xmax, 9)) == (0, 2)
+
+def test_droppedPad(tmp_path):
+    layer = _load(tmp_path, [shapely.box(0, 0, 1, 5)])
+    _addPad(layer, 0.5, 0, width=0.2, height=0.2)
+
+    assert _reload(layer, [shapely.box(5, 5, 6, 6)]) == (0, 1, 0, 1)
+    assert _pads(layer) == []
@@ -0,0 +1,64 @@
+'''
+Minimum width and clearance validation of the nets.
+'''
+
+import pytest
+import shapely
+
+from GerberLayer import GerberLayer
+from GerberNet import GerberNet
+import SyntheticLayout
+
+# a pad with a narrow 0.1 mm neck, a net 0.15 mm away and a separate net far away
+POLYS = [
+    shapely.union(shapely.box(0, 0, 1, 1), shapely.box(1, 0.45, 2, 0.55)),
+    shapely.box(2.15, 0, 3, 1),
+    shapely.box(10, 0, 11, 1),
+]
+
+def _layer(polys = POLYS):
+    layer = GerberLayer()
+    layer.nets = [GerberNet(p) for p in polys]
+
+    return layer
+
+def test_widthViolations():
+    layer = _layer()
+    widths, gaps = layer.validate(min_width=0.2)
+
+    assert gaps == []
+    assert [net for net, _ in widths] == [layer.getNets()[0]]
+    # the neck, not the pad
+    assert shapely.bounds(widths[0][1]).tolist() == pytest.approx([1, 0.45, 2, 0.55])
+
+def test_noWidthViolations():
+    widths, _ = _layer().validate(min_width=0.05)
+
+    assert widths == []
+
+def test_clearanceViolations():
+    layer = _layer()
+    widths, gaps = layer.validate(min_clearance=0.2)
+
+    assert widths == []
+    assert len(gaps) == 1
+
+    a, b, line, distance = gaps[0]
+
+    assert (a, b) == (layer.getNets()[0], layer.getNets()[1])
+    assert distance == pytest.approx(0.15)
+    assert shapely.length(line) == pytest.approx(0.15)
+
+def test_noValidation():
+    assert _layer().validate() == ([], [])
+    assert _layer([]).validate(0.2, 0.2) == ([], [])
+
+def test_validatedOnLoad(tmp_path):
+    filename = str(tmp_path / 'layer.dxf')
+    SyntheticLayout.writeDxf(filename, POLYS)
+
+    layer = GerberLayer(filename=filename, min_width=0.2, min_clearance=0.2)
+    widths, gaps = layer.violations
+
+    assert (len(widths), len(gaps)) == (1, 1)
+    assert GerberLayer(filename=filename).violations == None